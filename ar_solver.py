@@ -1,34 +1,245 @@
 from grid_detector import GridDetector
+from line_detector import LineDetector
+from grid_tracker import GridTracker
 from image_warper import ImageWarper
 from sudoku_solver import SudokuSolver
 from digit_reader import DigitReader
+from digit_corrector import DigitCorrector
+from solution_cache import SolutionCache
+from debug_writer import DebugWriter
 import cv2
 import copy
+import threading
+import time
 import numpy as np
 
 
+class SolveResult:
+    """
+    Result of one frame, corners are in the coordinates of the prepared image, confidences are
+    probabilities of the read digits (None for empty cells) and timings are milliseconds by stage.
+    corrections are (row, column, read number, new number) of digits changed to make the table solvable
+    """
+
+    def __init__(self, frame_id):
+        self.frame_id = frame_id
+        self.corners = None
+        self.table = None
+        self.solved_table = None
+        self.confidences = None
+        self.status = None
+        self.corrections = list()
+        self.timings = dict()
+        self.image = None
+
+    def to_dict(self):
+        def to_lists(table):
+            return None if table is None else [[int(number) for number in row] for row in table]
+
+        return {'frame_id': self.frame_id,
+                'corners': None if self.corners is None else np.asarray(self.corners).tolist(),
+                'table': to_lists(self.table),
+                'solved_table': to_lists(self.solved_table),
+                'confidences': self.confidences,
+                'status': self.status,
+                'corrections': [list(change) for change in self.corrections],
+                'timings': self.timings}
+
+
 class SudokuArSolver:
 
     MAX_IMG_SIZE = 400
+    MAX_SOLVE_TIME = 0.05
+    MAX_CORRECTION_TIME = 0.03
 
-    def __init__(self):
-        self.grid_detector = GridDetector()
+    def __init__(self, cache_size=64, canonical_cache=False, tracking=False,
+                 redetect_interval=GridTracker.REDETECT_INTERVAL, show_debug=True, backend='tensorflow',
+                 preload=False, detection_size=None, line_merge_mode=LineDetector.MERGE_GREEDY, roi=False,
+                 preprocess_mode=GridDetector.PREPROCESS_GAUSSIAN, debug_dir=None, temporal_digits=False,
+                 correction=False):
+        """
+        The digit model is loaded on the first frame which needs it, with preload it starts loading
+        in background right away. With detection_size frames keep their resolution, the grid is found
+        on the frame shrunk to detection_size, its corners are refined in full resolution and digits
+        are read from the frame shrunk to MAX_IMG_SIZE, which is searched when the small frame fails.
+        With roi the grid is searched around its last position first. With debug_dir the frames,
+        thresholded images, warps and results are written there in background. temporal_digits fuses digits of every cell over frames
+        and skips the model for stable cells, it is meant for video. With correction a table which
+        can not be solved gets the most likely alternative digits of its least confident cells
+        """
+        self.show_debug = show_debug
+        self.detection_size = detection_size
+        self.grid_detector = GridDetector(line_merge_mode, use_roi=roi, preprocess_mode=preprocess_mode)
+        self.grid_tracker = GridTracker(redetect_interval) if tracking else None
         self.warper = ImageWarper()
-        self.sudoku_solver = SudokuSolver(9)
-        self.digit_reader = DigitReader()
+        self.sudoku_solver = SudokuSolver(9, max_time=self.MAX_SOLVE_TIME, check_unique=True)
+        self.solution_cache = SolutionCache(9, cache_size, canonical_cache)
+        self.digit_corrector = DigitCorrector(9, max_time=self.MAX_CORRECTION_TIME) if correction else None
+        # read table -> corrected table, or the read table itself when no correction was found
+        self.correction_cache = SolutionCache(9, cache_size) if correction else None
+        self.backend = backend
+        self.temporal_digits = temporal_digits
+        self.digit_reader = None
+        self.digit_reader_lock = threading.Lock()
+        self.debug_writer = DebugWriter(debug_dir) if debug_dir is not None else None
+        self.frame_id = 0
+        self.solve_status = None
+        self.reading_image = None
+        if preload:
+            self.preload_digit_reader()
 
     def solve(self, image):
-        image = self.scale_too_big_image(image)
-        grid_corners = self.grid_detector.find_grid(image, show_img=True)
-        if grid_corners is None:
-            return image
-        warp = self.warper.warp(self.grid_detector.thresh_image, grid_corners)
-        table = self.digit_reader.read_numbers(warp)
-        self.sudoku_solver.print_grid(table)
+        return self.process(image, render=True, show_debug=self.show_debug).image
+
+    def process(self, image, render=False, show_debug=False):
+        """
+        Returns SolveResult of the image, the solution is drawn into result.image only with render.
+        Nothing is shown or printed without show_debug
+        """
+        result = SolveResult(self.frame_id)
+        self.frame_id += 1
+        start = time.perf_counter()
+        stage_start = start
+
+        def end_stage(stage):
+            nonlocal stage_start
+            now = time.perf_counter()
+            result.timings[stage] = (now - stage_start) * 1000
+            stage_start = now
+
+        image = self.prepare_image(image)
+        end_stage('prepare')
+        result.corners = self.find_grid_corners(image, show_debug)
+        end_stage('detect')
+        warp = None
+        image_with_numbers = None
+        if result.corners is not None:
+            warp = self.warp_grid(image, result.corners)
+            end_stage('warp')
+            digit_reader = self.get_digit_reader()
+            if self.digit_corrector is None:
+                result.table, result.confidences = digit_reader.read_numbers_with_confidence(warp)
+            else:
+                result.table, probabilities = digit_reader.read_numbers_with_probabilities(warp)
+                result.confidences = digit_reader.get_confidences(result.table, probabilities)
+            end_stage('read')
+            if show_debug:
+                self.sudoku_solver.print_grid(result.table)
+            result.solved_table = self.solve_table(result.table)
+            result.status = self.solve_status
+            end_stage('solve')
+            if self.digit_corrector is not None and result.status != SudokuSolver.STATUS_SOLVED:
+                corrected = self.correct_table(result.table, probabilities)
+                if corrected is not None:
+                    result.table, result.solved_table, result.corrections = corrected
+                    result.status = SudokuSolver.STATUS_SOLVED
+                end_stage('correct')
+            if render or show_debug or self.debug_writer is not None:
+                image_with_numbers = self.warper.render_numbers(result.table, result.solved_table)
+            if show_debug:
+                self.warper.show_numbers(warp, image_with_numbers)
+            if render:
+                result.image = self.warper.draw_numbers_to_original(image_with_numbers, image)
+            end_stage('render')
+        elif render:
+            result.image = image
+        result.timings['total'] = (time.perf_counter() - start) * 1000
+
+        if self.debug_writer is not None:
+            self.debug_writer.write(result.frame_id, {'frame': image, 'thresh': self.grid_detector.thresh_image,
+                                                      'warp': warp, 'numbers': image_with_numbers,
+                                                      'result': result.image})
+        return result
+
+    def get_digit_reader(self):
+        with self.digit_reader_lock:
+            if self.digit_reader is None:
+                self.digit_reader = DigitReader(self.backend, temporal=self.temporal_digits)
+            return self.digit_reader
+
+    def preload_digit_reader(self):
+        threading.Thread(target=self.get_digit_reader, daemon=True).start()
+
+    def prepare_image(self, image):
+        if self.detection_size is None:
+            return self.scale_too_big_image(image)
+        return image
+
+    def detect_grid(self, image, show_img=None):
+        show_img = self.show_debug if show_img is None else show_img
+        if self.detection_size is None:
+            return self.grid_detector.find_grid(image, show_img=show_img)
+        return self.grid_detector.find_grid_coarse_to_fine(image, self.detection_size, show_img=show_img,
+                                                           reference_image=self.get_reading_image(image))
+
+    def find_grid_corners(self, image, show_img=None):
+        if self.grid_tracker is None:
+            return self.detect_grid(image, show_img)
+
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        grid_corners = self.grid_tracker.track(gray)
+        if grid_corners is not None:
+            if self.detection_size is None:
+                self.grid_detector.update_thresh_image(image, grid_corners)
+            return grid_corners
+
+        grid_corners = self.detect_grid(image, show_img)
+        if grid_corners is not None:
+            self.grid_tracker.start(gray, grid_corners)
+        return grid_corners
+
+    def warp_grid(self, image, grid_corners, warper=None):
+        """ Warps thresholded grid for reading, the warper keeps grid_corners of image for drawing """
+        warper = warper or self.warper
+        if self.detection_size is None:
+            offset = self.grid_detector.thresh_offset
+            warp = warper.warp(self.grid_detector.thresh_image, grid_corners - offset)
+            warper.move_points(grid_corners, np.float64([[1, 0, -offset[0]], [0, 1, -offset[1]], [0, 0, 1]]))
+            return warp
+
+        reading_image = self.get_reading_image(image)
+        ratio = np.float32([reading_image.shape[1] / image.shape[1], reading_image.shape[0] / image.shape[0]])
+        warp = warper.warp(self.grid_detector.threshold_reference_image(reading_image), grid_corners * ratio)
+        warper.move_points(grid_corners, np.diag([ratio[0], ratio[1], 1.0]))
+        return warp
+
+    def solve_table(self, table):
+        cached = self.solution_cache.get(table)
+        if cached is not None:
+            self.solve_status = cached[1]
+            return cached[0]
         solved_table = self.sudoku_solver.solve(copy.deepcopy(table))
-        image_with_numbers = self.warper.write_number_to_image(warp, table, solved_table)
-        res = self.warper.draw_warp_to_original(image_with_numbers, image)
-        return res
+        self.solve_status = self.sudoku_solver.status
+        if self.sudoku_solver.status != SudokuSolver.STATUS_BUDGET_EXCEEDED:
+            self.solution_cache.put(table, solved_table, self.sudoku_solver.status)
+        return solved_table
+
+    def correct_table(self, table, probabilities):
+        """ Returns (corrected table, its solution, corrections) or None, outcomes are cached by the read table """
+        cached = self.correction_cache.get(table)
+        if cached is not None:
+            corrected_table, status = cached
+            if status != SudokuSolver.STATUS_SOLVED:
+                return None
+            corrections = [(r, c, int(table[r][c]), number) for r, row in enumerate(corrected_table)
+                           for c, number in enumerate(row) if number != table[r][c]]
+            return corrected_table, self.solve_table(corrected_table), corrections
+
+        corrected = self.digit_corrector.correct(table, probabilities)
+        if corrected is None:
+            if not self.digit_corrector.timed_out:
+                self.correction_cache.put(table, table, SudokuSolver.STATUS_UNSOLVABLE)
+            return None
+        corrected_table, solved_table, _ = corrected
+        self.correction_cache.put(table, corrected_table, SudokuSolver.STATUS_SOLVED)
+        self.solution_cache.put(corrected_table, solved_table, SudokuSolver.STATUS_SOLVED)
+        return corrected
+
+    def get_reading_image(self, image):
+        """ Frame shrunk to MAX_IMG_SIZE, made once per frame for both detection and reading """
+        if self.reading_image is None or self.reading_image[0] is not image:
+            self.reading_image = image, self.scale_too_big_image(image)
+        return self.reading_image[1]
 
     @staticmethod
     def scale_too_big_image(image):
@@ -46,6 +257,7 @@ class SudokuArSolver:
         cv2.waitKey()
 
     def start_camera(self):
+        self.preload_digit_reader()
         cap = cv2.VideoCapture(0)
         while True:
             ret, frame = cap.read()
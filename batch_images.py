@@ -0,0 +1,147 @@
+import argparse
+import functools
+import glob
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import cv2
+from ar_solver import SudokuArSolver
+from grid_detector import GridDetector
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+# one thread decodes the next image while the other encodes overlays
+IO_THREADS = 2
+
+_worker_ar_solver = None
+_worker_io = None
+
+
+def init_worker(backend, solver_kwargs):
+    global _worker_ar_solver, _worker_io
+    _worker_ar_solver = SudokuArSolver(show_debug=False, backend=backend, **solver_kwargs)
+    _worker_ar_solver.get_digit_reader()
+    _worker_io = ThreadPoolExecutor(IO_THREADS)
+
+
+def read_image(path):
+    start = time.perf_counter()
+    image = cv2.imread(path)
+    return image, (time.perf_counter() - start) * 1000
+
+
+def write_image(path, image):
+    start = time.perf_counter()
+    cv2.imwrite(path, image)
+    return (time.perf_counter() - start) * 1000
+
+
+def get_overlay_path(overlay_dir, index, path):
+    return os.path.join(overlay_dir, '{:06d}_{}'.format(index, os.path.basename(path)))
+
+
+def process_chunk(chunk, overlay_dir=None):
+    """
+    Processes (index, path) pairs, the next image is decoded and overlays are encoded in background
+    while the current image is processed. Returns one record per image
+    """
+    records = list()
+    writes = list()
+    pending = _worker_io.submit(read_image, chunk[0][1])
+    for k, (index, path) in enumerate(chunk):
+        image, decode_time = pending.result()
+        if k + 1 < len(chunk):
+            pending = _worker_io.submit(read_image, chunk[k + 1][1])
+        record = {'index': index, 'path': path}
+        records.append(record)
+        if image is None:
+            record['error'] = 'Image can not be read'
+            continue
+
+        result = _worker_ar_solver.process(image, render=overlay_dir is not None)
+        record.update(result.to_dict())
+        del record['frame_id']
+        record['timings']['decode'] = decode_time
+        if overlay_dir is not None:
+            record['overlay'] = get_overlay_path(overlay_dir, index, path)
+            writes.append((record, _worker_io.submit(write_image, record['overlay'], result.image)))
+
+    for record, write in writes:
+        record['timings']['encode'] = write.result()
+    return records
+
+
+def list_images(source):
+    """ source is a directory (its images are listed) or a glob pattern """
+    if os.path.isdir(source):
+        return sorted(os.path.join(source, name) for name in os.listdir(source)
+                      if name.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(glob.glob(source, recursive=True))
+
+
+def create_chunks(paths, chunk_size):
+    indexed = enumerate(paths)
+    while True:
+        chunk = list(islice(indexed, chunk_size))
+        if not chunk:
+            break
+        yield chunk
+
+
+def process_images(paths, output_path, overlay_dir=None, workers=None, chunk_size=8, backend='tensorflow',
+                   **solver_kwargs):
+    """
+    Processes images in a process pool, every worker keeps its own SudokuArSolver with the model loaded
+    once. Records are written to output_path as JSON lines in the order of paths as chunks are finished,
+    overlays with the drawn solution are written to overlay_dir. Returns counts of images, found grids
+    and solved puzzles
+    """
+    workers = workers or multiprocessing.cpu_count()
+    if overlay_dir is not None:
+        os.makedirs(overlay_dir, exist_ok=True)
+    counts = {'images': 0, 'found': 0, 'solved': 0}
+    chunks = create_chunks(paths, chunk_size)
+    task = functools.partial(process_chunk, overlay_dir=overlay_dir)
+    with open(output_path, 'w') as dst:
+        if workers == 1:
+            init_worker(backend, solver_kwargs)
+            results = map(task, chunks)
+            write_records(dst, results, counts)
+        else:
+            with multiprocessing.Pool(workers, initializer=init_worker, initargs=(backend, solver_kwargs)) as pool:
+                write_records(dst, pool.imap(task, chunks), counts)
+    return counts
+
+
+def write_records(dst, results, counts):
+    for records in results:
+        for record in records:
+            dst.write(json.dumps(record) + '\n')
+            counts['images'] += 1
+            counts['found'] += record.get('corners') is not None
+            counts['solved'] += record.get('status') == 'solved'
+        dst.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Solve sudoku images and write results as JSON lines')
+    parser.add_argument('input', help='directory with images or glob pattern (quoted, ** is recursive)')
+    parser.add_argument('output', help='JSONL file for results')
+    parser.add_argument('--overlay-dir', default=None, help='directory for images with drawn solutions')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=8)
+    parser.add_argument('--backend', default='tensorflow')
+    parser.add_argument('--detection-size', type=int, default=None)
+    parser.add_argument('--preprocess-mode', default=GridDetector.PREPROCESS_GAUSSIAN,
+                        choices=(GridDetector.PREPROCESS_GAUSSIAN, GridDetector.PREPROCESS_FAST))
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    image_paths = list_images(args.input)
+    result_counts = process_images(image_paths, args.output, args.overlay_dir, args.workers, args.chunk_size,
+                                   args.backend, detection_size=args.detection_size,
+                                   preprocess_mode=args.preprocess_mode)
+    print('Processed {images} images, found {found} grids, solved {solved} puzzles'.format(**result_counts)
+          + ' in {:.2f} s'.format(time.perf_counter() - start_time))
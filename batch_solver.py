@@ -0,0 +1,111 @@
+import argparse
+import multiprocessing
+import time
+from collections import namedtuple
+from itertools import islice
+from sudoku_solver import SudokuSolver
+
+SolveResult = namedtuple('SolveResult', ['grid', 'status', 'time'])
+
+CHUNKS_PER_WORKER = 4
+EMPTY_CHARS = '0.'
+
+_worker_solver = None
+
+
+def init_worker(grid_size, solver_kwargs):
+    global _worker_solver
+    _worker_solver = SudokuSolver(grid_size, **solver_kwargs)
+
+
+def solve_grid(grid):
+    start = time.perf_counter()
+    solved = _worker_solver.solve([list(row) for row in grid])
+    return SolveResult(solved, _worker_solver.status, time.perf_counter() - start)
+
+
+def get_chunk_size(count, workers):
+    return max(1, count // (workers * CHUNKS_PER_WORKER))
+
+
+def solve_many(grids, workers=None, chunk_size=None, grid_size=9, **solver_kwargs):
+    """
+    Solves grids in a process pool, every worker keeps its own SudokuSolver.
+    Returns list of SolveResult (grid, status, time in seconds) in the same order as grids,
+    solver_kwargs are passed to SudokuSolver (engine, search, max_nodes, max_time, check_unique)
+    """
+    grids = list(grids)
+    workers = workers or multiprocessing.cpu_count()
+    if workers == 1:
+        init_worker(grid_size, solver_kwargs)
+        return [solve_grid(grid) for grid in grids]
+
+    if chunk_size is None:
+        chunk_size = get_chunk_size(len(grids), workers)
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(grid_size, solver_kwargs)) as pool:
+        return pool.map(solve_grid, grids, chunksize=chunk_size)
+
+
+def parse_puzzle_line(line, grid_size=9):
+    """
+    Reads puzzle from text line ('0' or '.' for empty cell), for CSV lines the first column is used.
+    Returns None for lines which are not puzzles (headers, blank lines)
+    """
+    line = line.strip().split(',')[0].strip()
+    if len(line) != grid_size * grid_size:
+        return None
+    cells = list()
+    for char in line:
+        if char in EMPTY_CHARS:
+            cells.append(SudokuSolver.EMPTY_CELL)
+        elif char.isdigit():
+            cells.append(int(char))
+        else:
+            return None
+    return [cells[i * grid_size:(i + 1) * grid_size] for i in range(grid_size)]
+
+
+def format_grid(grid):
+    return ''.join(str(cell) for row in grid for cell in row)
+
+
+def solve_file(input_path, output_path, workers=None, chunk_size=64, grid_size=9, **solver_kwargs):
+    """
+    Streams puzzles from input_path (one puzzle per line) through a process pool and writes
+    'puzzle,solution,status,time_ms' lines to output_path as they are solved.
+    Only a window of a few chunks per worker is kept in memory. Returns number of puzzles
+    """
+    workers = workers or multiprocessing.cpu_count()
+    window_size = workers * chunk_size * CHUNKS_PER_WORKER
+    count = 0
+    with open(input_path) as src, open(output_path, 'w') as dst, \
+            multiprocessing.Pool(workers, initializer=init_worker, initargs=(grid_size, solver_kwargs)) as pool:
+        dst.write('puzzle,solution,status,time_ms\n')
+        puzzles = (puzzle for puzzle in (parse_puzzle_line(line, grid_size) for line in src) if puzzle is not None)
+        while True:
+            window = list(islice(puzzles, window_size))
+            if not window:
+                break
+            for puzzle, result in zip(window, pool.imap(solve_grid, window, chunksize=chunk_size)):
+                dst.write('{},{},{},{:.3f}\n'.format(format_grid(puzzle), format_grid(result.grid),
+                                                     result.status, result.time * 1000))
+            dst.flush()
+            count += len(window)
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Solve sudoku puzzles from a text or CSV file')
+    parser.add_argument('input', help='file with one 81 character puzzle per line')
+    parser.add_argument('output', help='CSV file for solutions')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=64)
+    parser.add_argument('--max-time', type=float, default=None, help='search budget per puzzle in seconds')
+    parser.add_argument('--check-unique', action='store_true',
+                        help='mark puzzles with more than one solution as multiple_solutions')
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    solved_count = solve_file(args.input, args.output, args.workers, args.chunk_size, max_time=args.max_time,
+                              check_unique=args.check_unique)
+    print('Solved {} puzzles in {:.2f} s'.format(solved_count, time.perf_counter() - start_time))
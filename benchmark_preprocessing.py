@@ -0,0 +1,54 @@
+import argparse
+import glob
+import time
+import cv2
+from ar_solver import SudokuArSolver
+from grid_detector import GridDetector
+
+
+def measure_preprocessing(image, preprocess_mode, repeat=50):
+    """ Returns mean milliseconds of thresholding, small contour filtering and the whole find_grid """
+    detector = GridDetector(preprocess_mode=preprocess_mode)
+    detector.find_grid(image, show_img=False)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        thresh = detector.preprocess_image(image)
+    threshold_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        detector.filter_small_contours(thresh)
+    filter_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        detector.find_grid(image, show_img=False)
+    find_grid_time = time.perf_counter() - start
+
+    return {'threshold_ms': threshold_time * 1000 / repeat, 'filter_ms': filter_time * 1000 / repeat,
+            'find_grid_ms': find_grid_time * 1000 / repeat}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare preprocessing modes of GridDetector')
+    parser.add_argument('--images', default='test_img/*.jpg')
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    modes = (GridDetector.PREPROCESS_GAUSSIAN, GridDetector.PREPROCESS_FAST)
+    totals = {mode: dict() for mode in modes}
+    for path in sorted(glob.glob(args.images)):
+        image = SudokuArSolver.scale_too_big_image(cv2.imread(path))
+        for mode in modes:
+            times = measure_preprocessing(image, mode, args.repeat)
+            for key, value in times.items():
+                totals[mode][key] = totals[mode].get(key, 0.0) + value
+            print('{} {}: '.format(path, mode) + ', '.join('{} {:.2f}'.format(key, value)
+                                                          for key, value in times.items()))
+
+    for mode in modes:
+        print('total {}: '.format(mode) + ', '.join('{} {:.2f}'.format(key, value)
+                                                   for key, value in totals[mode].items()))
+    print('speedup: ' + ', '.join('{} {:.2f}x'.format(key, totals[modes[0]][key] / totals[modes[1]][key])
+                                  for key in totals[modes[0]]))
@@ -0,0 +1,70 @@
+import argparse
+import glob
+import json
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+def post(url, data, content_type):
+    """ Returns (latency in seconds, decoded JSON response or None on error) """
+    request = urllib.request.Request(url, data=data, headers={'Content-Type': content_type})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as response:
+            content = json.loads(response.read())
+    except OSError:
+        content = None
+    return time.perf_counter() - start, content
+
+
+def run_load(url, payloads, content_type, requests, concurrency):
+    """ Sends requests payloads (cycled) from concurrency threads, returns latencies, errors and total time """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(lambda i: post(url, payloads[i % len(payloads)], content_type), range(requests)))
+    total_time = time.perf_counter() - start
+    latencies = [latency for latency, content in results if content is not None]
+    return latencies, len(results) - len(latencies), total_time
+
+
+def print_report(name, latencies, errors, total_time):
+    if not latencies:
+        print('{}: all {} requests failed'.format(name, errors))
+        return
+    latencies_ms = np.asarray(latencies) * 1000
+    print('{}: {} requests, {} errors, p50 {:.1f} ms, p99 {:.1f} ms, mean {:.1f} ms, {:.1f} requests/s'.format(
+        name, len(latencies), errors, np.percentile(latencies_ms, 50), np.percentile(latencies_ms, 99),
+        np.mean(latencies_ms), len(latencies) / total_time))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load test of solve_service.py running on localhost')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--images', default='test_img/*.jpg')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--overlay', action='store_true')
+    args = parser.parse_args()
+
+    base_url = 'http://127.0.0.1:{}'.format(args.port)
+    solve_url = base_url + '/solve' + ('?overlay=1' if args.overlay else '')
+    images = list()
+    for path in sorted(glob.glob(args.images)):
+        with open(path, 'rb') as f:
+            images.append(f.read())
+
+    # the warm up pass also gives the grids for the grid endpoint
+    grids = list()
+    for image in images:
+        _, content = post(solve_url, image, 'application/octet-stream')
+        if content is not None and content['table'] is not None:
+            grids.append(json.dumps({'grid': content['table']}).encode('utf-8'))
+
+    print_report('/solve', *run_load(solve_url, images, 'application/octet-stream', args.requests, args.concurrency))
+    if grids:
+        print_report('/grid', *run_load(base_url + '/grid', grids, 'application/json', args.requests,
+                                        args.concurrency))
+    with urllib.request.urlopen(base_url + '/stats') as stats_response:
+        print('service: {}'.format(json.loads(stats_response.read())))
@@ -0,0 +1,47 @@
+import argparse
+import json
+import subprocess
+import sys
+
+# runs in a fresh interpreter, so nothing is imported or loaded in advance
+STARTUP_SCRIPT = '''
+import json
+import time
+start = time.perf_counter()
+import cv2
+from ar_solver import SudokuArSolver
+import_time = time.perf_counter() - start
+
+start = time.perf_counter()
+solver = SudokuArSolver(show_debug=False, backend={backend!r}, preload={preload!r})
+init_time = time.perf_counter() - start
+
+image = cv2.imread({image!r})
+start = time.perf_counter()
+solver.solve(image)
+first_frame_time = time.perf_counter() - start
+
+print(json.dumps({{'import_s': import_time, 'init_s': init_time, 'first_frame_s': first_frame_time,
+                  'total_s': import_time + init_time + first_frame_time}}))
+'''
+
+
+def measure_startup(backend='tensorflow', preload=False, image='test_img/6.jpg'):
+    """ Measures import time, SudokuArSolver construction and first solved frame in a new process """
+    script = STARTUP_SCRIPT.format(backend=backend, preload=preload, image=image)
+    output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure cold start of the AR solver')
+    parser.add_argument('--backends', nargs='+', default=['tensorflow'])
+    parser.add_argument('--image', default='test_img/6.jpg')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    for backend_name in args.backends:
+        for preload_model in (False, True):
+            runs = [measure_startup(backend_name, preload_model, args.image) for _ in range(args.repeat)]
+            print('{} preload={}: '.format(backend_name, preload_model) + ', '.join(
+                '{} {:.3f}'.format(key, min(run[key] for run in runs)) for key in runs[0]))
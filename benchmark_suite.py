@@ -0,0 +1,291 @@
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+import cv2
+import numpy as np
+from ar_solver import SudokuArSolver
+from corner_finder import CornerFinder
+from grid_detector import GridDetector
+from image_warper import ImageWarper
+from line_detector import LineDetector
+from point_finder import PointsFinder
+from sudoku_solver import SudokuSolver
+
+GROUND_TRUTH_PATH = 'test_img/ground_truth.json'
+# a grid is detected when no corner is further than this part of the grid side from the ground truth
+CORNER_TOLERANCE = 0.03
+SYNTHETIC_SIZE = 400
+SYNTHETIC_CELL_SIZE = 48
+SYNTHETIC_GIVENS_RATIO = 0.35
+# higher is better for these results, lower for the rest (times)
+HIGHER_IS_BETTER = ('fps', 'detection_rate', 'cell_accuracy', 'board_accuracy', 'solved_rate')
+
+
+class BenchmarkCase:
+
+    def __init__(self, name, image, corners, givens):
+        """ corners are fractions of the image width and height, givens are 9x9 lists """
+        self.name = name
+        self.image = image
+        self.corners = np.float32(corners)
+        self.givens = givens
+
+
+def load_ground_truth_cases(path=GROUND_TRUTH_PATH):
+    with open(path) as f:
+        ground_truth = json.load(f)
+    cases = list()
+    for name, truth in ground_truth.items():
+        image = cv2.imread(os.path.join(os.path.dirname(path), name))
+        givens = [[int(number) for number in row] for row in truth['givens']]
+        cases.append(BenchmarkCase(name, image, truth['corners'], givens))
+    return cases
+
+
+def generate_solution(rng):
+    """ Shuffles digits, rows in bands, columns in stacks, bands and stacks of a valid pattern """
+    pattern = [[(r * 3 + r // 3 + c) % 9 for c in range(9)] for r in range(9)]
+    digits = rng.permutation(9) + 1
+    rows = [band * 3 + r for band in rng.permutation(3) for r in rng.permutation(3)]
+    columns = [stack * 3 + c for stack in rng.permutation(3) for c in rng.permutation(3)]
+    return [[int(digits[pattern[r][c]]) for c in columns] for r in rows]
+
+
+def render_board(puzzle, cell_size=SYNTHETIC_CELL_SIZE, margin=3):
+    """ Returns the grayscale board and its corners """
+    size = cell_size * 9
+    board = np.full((size + 2 * margin + 1, size + 2 * margin + 1), 255, np.uint8)
+    for i in range(10):
+        thickness = 5 if i % 3 == 0 else 2
+        position = margin + i * cell_size
+        cv2.line(board, (position, margin), (position, margin + size), 0, thickness)
+        cv2.line(board, (margin, position), (margin + size, position), 0, thickness)
+    for r in range(9):
+        for c in range(9):
+            if puzzle[r][c] == 0:
+                continue
+            # thin strokes as in printed puzzles, bolder digits are misread once blurred and thresholded
+            (width, height), _ = cv2.getTextSize(str(puzzle[r][c]), cv2.FONT_HERSHEY_SIMPLEX, 1.2, 1)
+            origin = (margin + c * cell_size + (cell_size - width) // 2, margin + r * cell_size + (cell_size + height) // 2)
+            cv2.putText(board, str(puzzle[r][c]), origin, cv2.FONT_HERSHEY_SIMPLEX, 1.2, 0, 1, cv2.LINE_AA)
+    corners = np.float32([[margin, margin], [margin + size, margin], [margin + size, margin + size],
+                          [margin, margin + size]])
+    return board, corners
+
+
+def render_scene(rng, puzzle, size=SYNTHETIC_SIZE):
+    """ Board seen in perspective on a gray paper with blur and noise, returns the image and the board corners """
+    board, board_corners = render_board(puzzle)
+    while True:
+        side = size * rng.uniform(0.72, 0.85)
+        center = size / 2 + rng.uniform(-0.03, 0.03, 2) * size
+        angle = rng.uniform(-0.12, 0.12)
+        rotation = np.float32([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+        square = np.float32([[-1, -1], [1, -1], [1, 1], [-1, 1]]) * side / 2
+        corners = np.float32(square @ rotation.T + center + rng.uniform(-0.03, 0.03, (4, 2)) * side)
+        if corners.min() >= 4 and corners.max() <= size - 4:
+            break
+
+    M = cv2.getPerspectiveTransform(board_corners, corners)
+    paper = rng.uniform(170, 230)
+    inside = cv2.warpPerspective(np.ones_like(board), M, (size, size)) > 0
+    image = cv2.warpPerspective(board, M, (size, size), borderValue=int(paper)).astype(np.float32)
+    # the board is lit the same as the paper around it
+    image[inside] *= paper / 255 + (1 - paper / 255) * 0.6
+    image = cv2.GaussianBlur(image, (3, 3), rng.uniform(0.5, 1.2)) + rng.normal(0, rng.uniform(3, 8), image.shape)
+    image = cv2.cvtColor(np.clip(image, 0, 255).astype(np.uint8), cv2.COLOR_GRAY2BGR)
+    return image, corners
+
+
+def add_givens_until_unique(rng, givens, solution, sudoku_solver):
+    """ Fills random empty cells of givens from the solution until it is the only solution """
+    empty = [(r, c) for r, row in enumerate(givens) for c, number in enumerate(row) if number == 0]
+    order = iter(rng.permutation(len(empty)))
+    while not sudoku_solver.has_unique_solution(givens):
+        r, c = empty[next(order)]
+        givens[r][c] = solution[r][c]
+
+
+def create_synthetic_cases(count, seed=0):
+    rng = np.random.default_rng(seed)
+    sudoku_solver = SudokuSolver(9)
+    cases = list()
+    for i in range(count):
+        solution = generate_solution(rng)
+        givens = [[number if rng.random() < SYNTHETIC_GIVENS_RATIO else 0 for number in row] for row in solution]
+        add_givens_until_unique(rng, givens, solution, sudoku_solver)
+        image, corners = render_scene(rng, givens)
+        cases.append(BenchmarkCase('synthetic_{}'.format(i), image, corners / SYNTHETIC_SIZE, givens))
+    return cases
+
+
+def get_corner_error(corners, expected):
+    """ Largest corner distance as a part of the mean side of the expected grid """
+    side = np.mean(np.linalg.norm(expected - np.roll(expected, 1, axis=0), axis=1))
+    return float(np.max(np.linalg.norm(np.float32(corners) - expected, axis=1)) / side)
+
+
+def clear_caches(ar_solver):
+    ar_solver.solution_cache.clear()
+    if ar_solver.correction_cache is not None:
+        ar_solver.correction_cache.clear()
+
+
+def evaluate(ar_solver, cases, repeat=3):
+    """ End to end speed of process() over the cases and accuracy of its first pass """
+    detected = 0
+    correct_cells = 0
+    correct_boards = 0
+    solved = 0
+    for case in cases:
+        result = ar_solver.process(case.image)
+        if result.corners is None:
+            continue
+        # corners are in the prepared image, which keeps the aspect ratio
+        shape = ar_solver.prepare_image(case.image).shape
+        if get_corner_error(result.corners, case.corners * [shape[1], shape[0]]) > CORNER_TOLERANCE:
+            continue
+        detected += 1
+        cells = sum(int(number == expected) for row, expected_row in zip(result.table, case.givens)
+                    for number, expected in zip(row, expected_row))
+        correct_cells += cells
+        correct_boards += cells == 81
+        solved += result.status == SudokuSolver.STATUS_SOLVED
+
+    # caches are filled by the accuracy pass, clear them so every timed frame is solved again
+    total_time = 0.0
+    for _ in range(repeat):
+        for case in cases:
+            clear_caches(ar_solver)
+            start = time.perf_counter()
+            ar_solver.process(case.image)
+            total_time += time.perf_counter() - start
+    frame_time = total_time / (repeat * len(cases))
+    return {'images': len(cases), 'fps': 1 / frame_time, 'frame_ms': frame_time * 1000,
+            'detection_rate': detected / len(cases),
+            'cell_accuracy': correct_cells / (81 * detected) if detected > 0 else 0.0,
+            'board_accuracy': correct_boards / len(cases), 'solved_rate': solved / len(cases)}
+
+
+def measure(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return (time.perf_counter() - start) * 1000 / repeat, result
+
+
+def benchmark_stages(ar_solver, cases, repeat=20):
+    """
+    Mean milliseconds of every stage over the cases at the detection reference size,
+    digits are read from grids warped by the ground truth corners
+    """
+    detector = GridDetector(ar_solver.grid_detector.line_merge_mode,
+                            preprocess_mode=ar_solver.grid_detector.preprocess_mode)
+    digit_reader = ar_solver.get_digit_reader()
+    stages = ('preprocess_image', 'filter_small_contours', 'find_lines', 'points_finder', 'estimate_corners',
+              'read_numbers', 'solve')
+    totals = dict.fromkeys(stages, 0.0)
+    for case in cases:
+        image = SudokuArSolver.scale_too_big_image(case.image)
+        elapsed, thresh = measure(lambda: detector.preprocess_image(image), repeat)
+        totals['preprocess_image'] += elapsed
+        elapsed, filtered = measure(lambda: detector.filter_small_contours(thresh), repeat)
+        totals['filter_small_contours'] += elapsed
+        elapsed, lines = measure(lambda: detector.line_detector.find_lines(filtered), repeat)
+        totals['find_lines'] += elapsed
+        if lines is not None:
+            elapsed, points_finder = measure(lambda: PointsFinder(filtered, lines,
+                                                                  crossing_space=detector.crossing_space), repeat)
+            totals['points_finder'] += elapsed
+            lines_with_points = points_finder.get_lines_with_points()
+            elapsed, _ = measure(lambda: CornerFinder().estimate_corners(lines_with_points), repeat)
+            totals['estimate_corners'] += elapsed
+
+        warp = ImageWarper().warp(thresh, case.corners * [image.shape[1], image.shape[0]])
+        elapsed, _ = measure(lambda: digit_reader.read_numbers(warp), repeat)
+        totals['read_numbers'] += elapsed
+        sudoku_solver = SudokuSolver(9)
+        elapsed, _ = measure(lambda: sudoku_solver.solve(copy.deepcopy(case.givens)), repeat)
+        totals['solve'] += elapsed
+    return {stage + '_ms': total / len(cases) for stage, total in totals.items()}
+
+
+def run_benchmark(backend='tensorflow', repeat=3, stage_repeat=20, synthetic_count=50, seed=0, **solver_kwargs):
+    ar_solver = SudokuArSolver(show_debug=False, backend=backend, **solver_kwargs)
+    ground_truth_cases = load_ground_truth_cases()
+    synthetic_cases = create_synthetic_cases(synthetic_count, seed)
+    ar_solver.get_digit_reader()
+    results = {'config': dict(backend=backend, repeat=repeat, synthetic_count=synthetic_count, seed=seed,
+                              **solver_kwargs),
+               'test_img': evaluate(ar_solver, ground_truth_cases, repeat),
+               'synthetic': evaluate(ar_solver, synthetic_cases, repeat) if synthetic_cases else None,
+               'stages': benchmark_stages(ar_solver, ground_truth_cases, stage_repeat)}
+    return results
+
+
+def flatten(results, prefix=''):
+    values = dict()
+    for key, value in results.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, prefix + key + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and key != 'images':
+            values[prefix + key] = value
+    return values
+
+
+def compare(results, baseline, time_tolerance=0.1):
+    """
+    Returns report lines and whether accuracy dropped. Times worse by more than time_tolerance
+    are marked, they are not counted as regressions because of the timing noise
+    """
+    current = flatten({key: value for key, value in results.items() if key != 'config'})
+    previous = flatten({key: value for key, value in baseline.items() if key != 'config'})
+    lines = list()
+    accuracy_dropped = False
+    for key in sorted(current.keys() & previous.keys()):
+        old, new = previous[key], current[key]
+        higher_is_better = key.split('.')[-1] in HIGHER_IS_BETTER
+        change = (new - old) / old if old else 0.0
+        mark = ''
+        if key.split('.')[-1] in HIGHER_IS_BETTER[1:] and new < old - 1e-9:
+            mark = ' ACCURACY REGRESSION'
+            accuracy_dropped = True
+        elif (change < -time_tolerance) if higher_is_better else (change > time_tolerance):
+            mark = ' slower'
+        lines.append('{:<40} {:>10.3f} -> {:>10.3f} ({:+.1%}){}'.format(key, old, new, change, mark))
+    return lines, accuracy_dropped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Speed and accuracy of the AR solver on test_img and synthetic puzzles')
+    parser.add_argument('--backend', default='tensorflow')
+    parser.add_argument('--repeat', type=int, default=3, help='end to end passes over the images')
+    parser.add_argument('--stage-repeat', type=int, default=20)
+    parser.add_argument('--synthetic', type=int, default=50, help='number of generated puzzles')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--detection-size', type=int, default=None)
+    parser.add_argument('--line-merge-mode', default=LineDetector.MERGE_GREEDY,
+                        choices=(LineDetector.MERGE_GREEDY, LineDetector.MERGE_CLUSTER))
+    parser.add_argument('--preprocess-mode', default=GridDetector.PREPROCESS_GAUSSIAN,
+                        choices=(GridDetector.PREPROCESS_GAUSSIAN, GridDetector.PREPROCESS_FAST))
+    parser.add_argument('--correction', action='store_true', help='correct misread digits of unsolvable tables')
+    parser.add_argument('--output', default=None, help='JSON file for the results')
+    parser.add_argument('--baseline', default=None, help='JSON results to compare with')
+    args = parser.parse_args()
+
+    benchmark_results = run_benchmark(args.backend, args.repeat, args.stage_repeat, args.synthetic, args.seed,
+                                      detection_size=args.detection_size, line_merge_mode=args.line_merge_mode,
+                                      preprocess_mode=args.preprocess_mode, correction=args.correction)
+    print(json.dumps(benchmark_results, indent=2))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(benchmark_results, f, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            report, regression = compare(benchmark_results, json.load(f))
+        print('\n'.join(report))
+        if regression:
+            sys.exit(1)
@@ -0,0 +1,406 @@
+import math
+import time
+from collections import deque
+
+
+class BitmaskSolver:
+    """
+    Constraint propagation over per-row, per-column and per-chunk bitmasks.
+    Bit (n - 1) of a mask stands for number n. Cells are stored in a flat list
+    (index = row * grid_size + column) and only cells and units touched by a new
+    number are re-examined, instead of rescanning the whole grid on every pass.
+    """
+
+    EMPTY_CELL = 0
+
+    STATUS_SOLVED = 'solved'
+    STATUS_UNSOLVABLE = 'unsolvable'
+    STATUS_BUDGET_EXCEEDED = 'budget_exceeded'
+
+    def __init__(self, grid_size):
+        self.grid_size = grid_size
+        self.chunk_size = int(math.sqrt(grid_size))
+        self.full_mask = (1 << grid_size) - 1
+        self.placed_flag = 1 << grid_size
+        self.cells_count = grid_size * grid_size
+
+        self.cell_row = list()
+        self.cell_column = list()
+        self.cell_chunk = list()
+        for index in range(self.cells_count):
+            row_index, column_index = divmod(index, grid_size)
+            self.cell_row.append(row_index)
+            self.cell_column.append(column_index)
+            self.cell_chunk.append((row_index // self.chunk_size) * self.chunk_size
+                                   + column_index // self.chunk_size)
+
+        # units are numbered rows first, then columns, then chunks
+        self.units = [list() for _ in range(3 * grid_size)]
+        for index in range(self.cells_count):
+            self.units[self.cell_row[index]].append(index)
+            self.units[grid_size + self.cell_column[index]].append(index)
+            self.units[2 * grid_size + self.cell_chunk[index]].append(index)
+        self.cell_units = [(self.cell_row[i], grid_size + self.cell_column[i], 2 * grid_size + self.cell_chunk[i])
+                           for i in range(self.cells_count)]
+        self.peers = list()
+        for index in range(self.cells_count):
+            peers = set()
+            for unit_id in self.cell_units[index]:
+                peers.update(self.units[unit_id])
+            peers.discard(index)
+            self.peers.append(sorted(peers))
+
+        self.values = list()
+        self.rows_free = list()
+        self.columns_free = list()
+        self.chunks_free = list()
+        self.cells_queue = deque()
+        self.units_queue = deque()
+        self.cell_queued = list()
+        self.unit_queued = list()
+        self.nodes = 0
+        self.passes = 0
+
+    def read_grid(self, grid):
+        """
+        Loads grid (list of rows) into the masks, returns False when some number
+        is out of range or is used twice in a row, column or chunk
+        """
+        self.values = [int(cell) for row in grid for cell in row]
+        self.rows_free = [self.full_mask] * self.grid_size
+        self.columns_free = [self.full_mask] * self.grid_size
+        self.chunks_free = [self.full_mask] * self.grid_size
+        for index, number in enumerate(self.values):
+            if number == self.EMPTY_CELL:
+                continue
+            if number < 1 or number > self.grid_size:
+                return False
+            bit = 1 << (number - 1)
+            if not self.rows_free[self.cell_row[index]] & self.columns_free[self.cell_column[index]] \
+                    & self.chunks_free[self.cell_chunk[index]] & bit:
+                return False
+            self.remove_from_units(index, bit)
+        return True
+
+    def write_grid(self, grid):
+        for index, number in enumerate(self.values):
+            grid[self.cell_row[index]][self.cell_column[index]] = number
+        return grid
+
+    def get_state(self):
+        return list(self.values), list(self.rows_free), list(self.columns_free), list(self.chunks_free)
+
+    def set_state(self, state):
+        values, rows_free, columns_free, chunks_free = state
+        self.values = list(values)
+        self.rows_free = list(rows_free)
+        self.columns_free = list(columns_free)
+        self.chunks_free = list(chunks_free)
+
+    def remove_from_units(self, index, bit):
+        self.rows_free[self.cell_row[index]] &= ~bit
+        self.columns_free[self.cell_column[index]] &= ~bit
+        self.chunks_free[self.cell_chunk[index]] &= ~bit
+
+    def get_cell_candidates(self, index):
+        return self.rows_free[self.cell_row[index]] & self.columns_free[self.cell_column[index]] \
+            & self.chunks_free[self.cell_chunk[index]]
+
+    def get_unit_free(self, unit_id):
+        if unit_id < self.grid_size:
+            return self.rows_free[unit_id]
+        if unit_id < 2 * self.grid_size:
+            return self.columns_free[unit_id - self.grid_size]
+        return self.chunks_free[unit_id - 2 * self.grid_size]
+
+    def is_solved(self):
+        return self.EMPTY_CELL not in self.values
+
+    def put_new_number(self, index, number):
+        self.values[index] = number
+        self.remove_from_units(index, 1 << (number - 1))
+        for peer in self.peers[index]:
+            if self.values[peer] != self.EMPTY_CELL:
+                continue
+            self.enqueue_cell(peer)
+            for unit_id in self.cell_units[peer]:
+                self.enqueue_unit(unit_id)
+
+    def enqueue_cell(self, index):
+        if not self.cell_queued[index]:
+            self.cell_queued[index] = True
+            self.cells_queue.append(index)
+
+    def enqueue_unit(self, unit_id):
+        if not self.unit_queued[unit_id]:
+            self.unit_queued[unit_id] = True
+            self.units_queue.append(unit_id)
+
+    def reset_queues(self):
+        self.cells_queue = deque()
+        self.units_queue = deque()
+        self.cell_queued = [False] * self.cells_count
+        self.unit_queued = [False] * len(self.units)
+
+    def propagate(self):
+        """
+        Places naked and hidden singles until nothing changes.
+        Returns False when a contradiction is found
+        """
+        self.passes = 0
+        self.reset_queues()
+        for index in range(self.cells_count):
+            if self.values[index] == self.EMPTY_CELL:
+                self.enqueue_cell(index)
+        for unit_id in range(len(self.units)):
+            self.enqueue_unit(unit_id)
+        return self.process_queues()
+
+    def process_queues(self):
+        # a pass ends when everything queued at its start is processed, like a sweep of the lists engine
+        wave = 0
+        while self.cells_queue or self.units_queue:
+            if wave == 0:
+                self.passes += 1
+                wave = len(self.cells_queue) + len(self.units_queue)
+            wave -= 1
+            if self.cells_queue:
+                index = self.cells_queue.popleft()
+                self.cell_queued[index] = False
+                if not self.check_naked_single(index):
+                    return False
+            else:
+                unit_id = self.units_queue.popleft()
+                self.unit_queued[unit_id] = False
+                if not self.check_hidden_singles(unit_id):
+                    return False
+        return True
+
+    def check_naked_single(self, index):
+        if self.values[index] != self.EMPTY_CELL:
+            return True
+        candidates = self.get_cell_candidates(index)
+        if candidates == 0:
+            return False
+        if candidates & (candidates - 1) == 0:
+            self.put_new_number(index, candidates.bit_length())
+        return True
+
+    def check_hidden_singles(self, unit_id):
+        once = 0
+        twice = 0
+        for index in self.units[unit_id]:
+            if self.values[index] != self.EMPTY_CELL:
+                continue
+            candidates = self.get_cell_candidates(index)
+            twice |= once & candidates
+            once |= candidates
+        unit_free = self.get_unit_free(unit_id)
+        if unit_free & ~once:
+            # some missing number has no cell left in this unit
+            return False
+
+        hidden = unit_free & once & ~twice
+        while hidden:
+            bit = hidden & -hidden
+            hidden ^= bit
+            for index in self.units[unit_id]:
+                if self.values[index] == self.EMPTY_CELL and self.get_cell_candidates(index) & bit:
+                    self.put_new_number(index, bit.bit_length())
+                    break
+            else:
+                # the only cell for this number was taken by another hidden single
+                return False
+        return True
+
+    def search(self, max_nodes=None, max_time=None):
+        """
+        Propagates and then backtracks on the empty cell with the fewest candidates.
+        The search keeps its own stack, so its depth is bounded by the number of cells,
+        and it gives up after max_nodes guesses or max_time seconds.
+        On success values hold the solution, otherwise the propagated grid is kept
+        """
+        self.nodes = 0
+        if not self.propagate():
+            return self.STATUS_UNSOLVABLE
+        if self.is_solved():
+            return self.STATUS_SOLVED
+
+        start = time.perf_counter()
+        propagated_state = self.get_state()
+        stack = [self.pick_branch()]
+        while stack:
+            state, index, candidates = stack[-1]
+            if candidates == 0:
+                stack.pop()
+                continue
+            if (max_nodes is not None and self.nodes >= max_nodes) \
+                    or (max_time is not None and time.perf_counter() - start > max_time):
+                self.set_state(propagated_state)
+                return self.STATUS_BUDGET_EXCEEDED
+
+            bit = candidates & -candidates
+            stack[-1] = (state, index, candidates ^ bit)
+            self.nodes += 1
+            self.set_state(state)
+            self.reset_queues()
+            self.put_new_number(index, bit.bit_length())
+            if not self.process_queues():
+                continue
+            if self.is_solved():
+                return self.STATUS_SOLVED
+            stack.append(self.pick_branch())
+
+        self.set_state(propagated_state)
+        return self.STATUS_UNSOLVABLE
+
+    def count_solutions(self, limit=2, max_nodes=None, max_time=None):
+        """
+        Counts solutions of the loaded grid, the search stops once limit of them is found.
+        Values hold the solution when it is the only one, otherwise the propagated grid is kept.
+        Returns None when max_nodes or max_time runs out before the count is known.
+        The search copies only one list of cell masks per guess, the bit above the numbers
+        marks cells with a number placed
+        """
+        self.nodes = 0
+        self.passes = 0
+        cells = list()
+        pending = list()
+        for index, number in enumerate(self.values):
+            if number != self.EMPTY_CELL:
+                cells.append((1 << (number - 1)) | self.placed_flag)
+                continue
+            candidates = self.get_cell_candidates(index)
+            cells.append(candidates)
+            if candidates & (candidates - 1) == 0:
+                pending.append(index)
+        if not self.place_singles(cells, pending):
+            return 0
+        index = self.pick_cell(cells)
+        if index < 0:
+            self.read_cells(cells)
+            return 1
+
+        start = time.perf_counter()
+        propagated_cells = cells
+        solution_cells = None
+        count = 0
+        stack = [(cells, index, cells[index])]
+        while stack and count < limit:
+            cells, index, candidates = stack[-1]
+            if candidates == 0:
+                stack.pop()
+                continue
+            if (max_nodes is not None and self.nodes >= max_nodes) \
+                    or (max_time is not None and time.perf_counter() - start > max_time):
+                self.read_cells(propagated_cells)
+                return None
+
+            bit = candidates & -candidates
+            stack[-1] = (cells, index, candidates ^ bit)
+            self.nodes += 1
+            child = cells[:]
+            child[index] = bit
+            if not self.place_singles(child, [index]):
+                continue
+            child_index = self.pick_cell(child)
+            if child_index < 0:
+                count += 1
+                solution_cells = child
+                continue
+            stack.append((child, child_index, child[child_index]))
+
+        self.read_cells(solution_cells if count == 1 else propagated_cells)
+        return count
+
+    def place_singles(self, cells, pending):
+        """
+        Places cells of pending and all naked and hidden singles they lead to into cells (masks),
+        returns False when a cell or a number of some unit has no place left
+        """
+        peers = self.peers
+        units = self.units
+        placed_flag = self.placed_flag
+        full_mask = self.full_mask
+        while True:
+            self.passes += 1
+            while pending:
+                index = pending.pop()
+                bit = cells[index]
+                if bit & placed_flag:
+                    continue
+                cells[index] = bit | placed_flag
+                for peer in peers[index]:
+                    candidates = cells[peer]
+                    if candidates & bit:
+                        if candidates & placed_flag:
+                            return False
+                        candidates ^= bit
+                        if candidates == 0:
+                            return False
+                        cells[peer] = candidates
+                        if candidates & (candidates - 1) == 0:
+                            pending.append(peer)
+
+            for unit in units:
+                once = 0
+                twice = 0
+                placed = 0
+                for index in unit:
+                    candidates = cells[index]
+                    if candidates & placed_flag:
+                        placed |= candidates
+                    else:
+                        twice |= once & candidates
+                        once |= candidates
+                placed &= full_mask
+                if once | placed != full_mask:
+                    return False
+                hidden = once & ~twice & ~placed
+                while hidden:
+                    bit = hidden & -hidden
+                    hidden ^= bit
+                    # numbers placed in the unit are not hidden, so only empty cells can have the bit
+                    for index in unit:
+                        if cells[index] & bit:
+                            cells[index] = bit
+                            pending.append(index)
+                            break
+                    else:
+                        return False
+            if not pending:
+                return True
+
+    def pick_cell(self, cells):
+        """ Index of the empty cell with the fewest candidates, -1 when all cells are placed """
+        best_index = -1
+        best_count = self.grid_size + 1
+        for index, candidates in enumerate(cells):
+            if candidates & self.placed_flag:
+                continue
+            count = bin(candidates).count('1')
+            if count < best_count:
+                best_index, best_count = index, count
+                if count <= 2:
+                    break
+        return best_index
+
+    def read_cells(self, cells):
+        """ Sets values from cell masks, cells without a placed number stay empty """
+        self.values = [(candidates & self.full_mask).bit_length() if candidates & self.placed_flag
+                       else self.EMPTY_CELL for candidates in cells]
+
+    def pick_branch(self):
+        best_index = -1
+        best_candidates = 0
+        best_count = self.grid_size + 1
+        for index in range(self.cells_count):
+            if self.values[index] != self.EMPTY_CELL:
+                continue
+            candidates = self.get_cell_candidates(index)
+            count = bin(candidates).count('1')
+            if count < best_count:
+                best_index, best_candidates, best_count = index, candidates, count
+                if count <= 2:
+                    break
+        return self.get_state(), best_index, best_candidates
@@ -1,5 +1,6 @@
 from point_finder import PointsFinder
 import numpy as np
+import instrumentation
 
 
 class CornerFinder:
@@ -10,6 +11,7 @@ class CornerFinder:
         self.border_lines_ids = list()
         self.lines = list()
 
+    @instrumentation.timed('estimate_corners')
     def estimate_corners(self, lines_with_points):
         self.lines = lines_with_points
         self.middle_lines_ids = self.extract_middle_lines(lines_with_points)
@@ -85,8 +87,10 @@ class CornerFinder:
 
     def pick_best_corners(self):
         if len(self.border_lines_ids) < 4:
+            instrumentation.outcome('estimate_corners', 'few_border_lines')
             return None
         if len(self.middle_lines_ids) < 10:
+            instrumentation.outcome('estimate_corners', 'few_middle_lines')
             return None
 
         for line_id in self.border_lines_ids:
@@ -97,6 +101,8 @@ class CornerFinder:
             if another_points is None:
                 continue
             return [start[0], end[0], another_points[0], another_points[1]]
+        instrumentation.outcome('estimate_corners', 'no_corner_pairs')
+        return None
 
     def find_two_corners_on_line(self, line):
         start = None
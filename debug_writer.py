@@ -0,0 +1,50 @@
+import os
+import queue
+import threading
+import cv2
+
+
+class DebugWriter:
+    """
+    Writes debug images into a directory from a background thread, so frames are not slowed down
+    by encoding. When max_pending images wait for writing, new ones are dropped
+    """
+
+    STOP = None
+
+    def __init__(self, directory, max_pending=32, extension='png'):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.extension = extension
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.written = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, frame_id, images):
+        """ images maps names to images, they are copied because the caller may reuse its buffers """
+        for name, image in images.items():
+            if image is None:
+                continue
+            try:
+                self.queue.put_nowait((self.get_path(frame_id, name), image.copy()))
+            except queue.Full:
+                self.dropped += 1
+
+    def get_path(self, frame_id, name):
+        return os.path.join(self.directory, '{:06d}_{}.{}'.format(frame_id, name, self.extension))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is self.STOP:
+                break
+            path, image = item
+            cv2.imwrite(path, image)
+            self.written += 1
+
+    def close(self):
+        """ Waits until all queued images are written """
+        self.queue.put(self.STOP)
+        self.thread.join()
@@ -0,0 +1,158 @@
+import argparse
+import glob
+import numpy as np
+
+MODEL_DIR = 'tf-digits-model'
+ONNX_MODEL_PATH = 'tf-digits-model.onnx'
+TFLITE_MODEL_PATH = 'tf-digits-model.tflite'
+MODEL_INPUT_SIZE = 28
+
+
+class TensorflowBackend:
+    MAX_BATCH_SIZE = 4096
+
+    def __init__(self, model_path=MODEL_DIR):
+        import tensorflow as tf
+        self.tf = tf
+        self.model = tf.keras.models.load_model(model_path)
+        # direct call without the per-call overhead of predict(), traced once for any batch size
+        self.compiled_model = tf.function(
+            lambda x: self.model(x, training=False),
+            input_signature=[tf.TensorSpec([None, MODEL_INPUT_SIZE, MODEL_INPUT_SIZE], tf.float32)])
+
+    def predict(self, x):
+        predictions = list()
+        for start in range(0, len(x), self.MAX_BATCH_SIZE):
+            batch = self.tf.constant(x[start:start + self.MAX_BATCH_SIZE])
+            predictions.append(self.compiled_model(batch).numpy())
+        return np.concatenate(predictions)
+
+
+class OpenCvBackend:
+
+    def __init__(self, model_path=ONNX_MODEL_PATH):
+        import cv2
+        self.net = cv2.dnn.readNetFromONNX(model_path)
+
+    def predict(self, x):
+        self.net.setInput(x)
+        return self.net.forward()
+
+
+class OnnxBackend:
+
+    def __init__(self, model_path=ONNX_MODEL_PATH):
+        import onnxruntime
+        self.session = onnxruntime.InferenceSession(model_path, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, x):
+        return self.session.run(None, {self.input_name: x})[0]
+
+
+class TfliteBackend:
+
+    def __init__(self, model_path=TFLITE_MODEL_PATH):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        self.interpreter = Interpreter(model_path=model_path)
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self.batch_size = None
+
+    def predict(self, x):
+        if self.batch_size != len(x):
+            self.interpreter.resize_tensor_input(self.input_index, [len(x), MODEL_INPUT_SIZE, MODEL_INPUT_SIZE])
+            self.interpreter.allocate_tensors()
+            self.batch_size = len(x)
+        self.interpreter.set_tensor(self.input_index, x)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_index)
+
+
+BACKENDS = {
+    'tensorflow': TensorflowBackend,
+    'opencv': OpenCvBackend,
+    'onnx': OnnxBackend,
+    'tflite': TfliteBackend,
+}
+
+
+def create_backend(name, model_path=None):
+    if name not in BACKENDS:
+        raise ValueError('Unknown inference backend: {}'.format(name))
+    if model_path is None:
+        return BACKENDS[name]()
+    return BACKENDS[name](model_path)
+
+
+def export_model(model_format, model_dir=MODEL_DIR, output_path=None):
+    """
+    One-time export of the TensorFlow model for the lighter runtimes,
+    'onnx' (used by the onnx and opencv backends, needs tf2onnx) or 'tflite'
+    """
+    import tensorflow as tf
+    if model_format == 'tflite':
+        output_path = output_path or TFLITE_MODEL_PATH
+        converter = tf.lite.TFLiteConverter.from_saved_model(model_dir)
+        with open(output_path, 'wb') as f:
+            f.write(converter.convert())
+    elif model_format == 'onnx':
+        import tf2onnx
+        output_path = output_path or ONNX_MODEL_PATH
+        model = tf.keras.models.load_model(model_dir)
+        input_signature = [tf.TensorSpec([None, MODEL_INPUT_SIZE, MODEL_INPUT_SIZE], tf.float32, name='input')]
+        tf2onnx.convert.from_keras(model, input_signature=input_signature, output_path=output_path)
+    else:
+        raise ValueError('Unknown model format: {}'.format(model_format))
+    return output_path
+
+
+def check_parity(backend_name, images_pattern='test_img/*.jpg'):
+    """
+    Compares predictions of backend_name with the TensorFlow model on the cells of the test images.
+    Returns (number of cells, number of different digits, max absolute probability difference)
+    """
+    import cv2
+    from ar_solver import SudokuArSolver
+    from digit_reader import DigitReader
+    from grid_detector import GridDetector
+    from image_warper import ImageWarper
+
+    reference = DigitReader('tensorflow')
+    tested = DigitReader(backend_name)
+    grid_detector = GridDetector()
+    warper = ImageWarper()
+    inputs = list()
+    for path in sorted(glob.glob(images_pattern)):
+        image = SudokuArSolver.scale_too_big_image(cv2.imread(path))
+        corners = grid_detector.find_grid(image, show_img=False)
+        if corners is None:
+            continue
+        reference.extract_fields(warper.warp(grid_detector.thresh_image, corners))
+        inputs += reference.input
+
+    x = np.asarray(inputs, dtype=np.float32)
+    expected = reference.predict(x)
+    predicted = tested.predict(x)
+    different = np.count_nonzero(np.argmax(expected, axis=1) != np.argmax(predicted, axis=1))
+    return len(x), different, float(np.max(np.abs(expected - predicted)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export the digit model and check backend parity')
+    parser.add_argument('command', choices=['export', 'parity'])
+    parser.add_argument('target', help="model format for export ('onnx', 'tflite') or backend name for parity")
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        print('Exported to', export_model(args.target))
+    else:
+        cells, different_digits, max_difference = check_parity(args.target)
+        print('{} cells, {} different digits, max probability difference {:.6f}'.format(
+            cells, different_digits, max_difference))
+        if different_digits > 0:
+            raise SystemExit(1)
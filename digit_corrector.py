@@ -0,0 +1,112 @@
+import heapq
+import math
+import time
+import numpy as np
+from bitmask_solver import BitmaskSolver
+
+
+class DigitCorrector:
+    """
+    Repairs misread tables using the digit probabilities. Alternative digits of the least confident
+    cells (and of the cells breaking the rules) are tried best-first, ordered by how much less likely
+    the changed table is, until the table is valid and has exactly one solution. The search is limited
+    to max_changes cells changed at once, max_candidates tables checked, max_nodes guesses of the
+    solver per table and max_time seconds
+    """
+
+    EMPTY_CELL = 0
+    MIN_PROBABILITY = 1e-6
+
+    def __init__(self, grid_size=9, max_cells=8, max_alternatives=3, max_changes=3, max_candidates=300,
+                 max_nodes=2000, max_time=None):
+        self.grid_size = grid_size
+        self.max_cells = max_cells
+        self.max_alternatives = max_alternatives
+        self.max_changes = max_changes
+        self.max_candidates = max_candidates
+        self.max_nodes = max_nodes
+        self.max_time = max_time
+        self.bitmask_solver = BitmaskSolver(grid_size)
+        self.candidates = 0
+        self.timed_out = False
+
+    def correct(self, table, probabilities):
+        """
+        probabilities is an array (rows, columns, classes) as given by DigitReader.
+        Returns (corrected table, its solution, changes as (row, column, read number, new number))
+        of the most likely table with exactly one solution or None. timed_out tells whether max_time ended the search
+        """
+        start = time.perf_counter()
+        self.candidates = 0
+        self.timed_out = False
+        options = self.get_options(table, probabilities)
+        # every subset of options is reached once, either by adding the next option to the subset
+        # or by replacing its last option with the next one, both never lower the cost
+        queue = [(0.0, ())]
+        while queue and self.candidates < self.max_candidates:
+            if self.max_time is not None and time.perf_counter() - start > self.max_time:
+                self.timed_out = True
+                break
+            cost, subset = heapq.heappop(queue)
+            if subset:
+                last = subset[-1]
+                if last + 1 < len(options):
+                    heapq.heappush(queue, (cost - options[last][0] + options[last + 1][0], subset[:-1] + (last + 1,)))
+                    if len(subset) < self.max_changes:
+                        heapq.heappush(queue, (cost + options[last + 1][0], subset + (last + 1,)))
+            elif options:
+                heapq.heappush(queue, (options[0][0], (0,)))
+
+            changes = [options[k][1:] for k in subset]
+            if len(set((r, c) for r, c, _ in changes)) < len(changes):
+                continue
+            result = self.check_changes(table, changes)
+            if result is not None:
+                return result
+        return None
+
+    def get_options(self, table, probabilities):
+        """ Returns (cost, row, column, number) of the alternative numbers sorted by cost """
+        cells = [(probabilities[r][c][number], r, c) for r, row in enumerate(table)
+                 for c, number in enumerate(row) if number != self.EMPTY_CELL]
+        conflicts = self.find_conflicts(table)
+        cells.sort(key=lambda cell: ((cell[1], cell[2]) not in conflicts, cell[0]))
+
+        options = list()
+        for confidence, r, c in cells[:max(self.max_cells, len(conflicts))]:
+            cell_probabilities = probabilities[r][c]
+            alternatives = [number for number in np.argsort(cell_probabilities)[::-1]
+                            if number != table[r][c]][:self.max_alternatives]
+            for number in alternatives:
+                cost = math.log(max(confidence, self.MIN_PROBABILITY)) \
+                    - math.log(max(cell_probabilities[number], self.MIN_PROBABILITY))
+                options.append((cost, r, c, int(number)))
+        options.sort()
+        return options
+
+    def find_conflicts(self, table):
+        """ Cells whose number is repeated in their row, column or chunk """
+        chunk_size = int(math.sqrt(self.grid_size))
+        seen = dict()
+        conflicts = set()
+        for r, row in enumerate(table):
+            for c, number in enumerate(row):
+                if number == self.EMPTY_CELL:
+                    continue
+                for unit in (('row', r), ('column', c), ('chunk', r // chunk_size, c // chunk_size)):
+                    other = seen.setdefault((unit, number), (r, c))
+                    if other != (r, c):
+                        conflicts.update((other, (r, c)))
+        return conflicts
+
+    def check_changes(self, table, changes):
+        self.candidates += 1
+        changed_table = [list(row) for row in table]
+        for r, c, number in changes:
+            changed_table[r][c] = number
+        if not self.bitmask_solver.read_grid(changed_table):
+            return None
+        if self.bitmask_solver.count_solutions(2, self.max_nodes) != 1:
+            return None
+        solved_table = self.bitmask_solver.write_grid([list(row) for row in changed_table])
+        return changed_table, solved_table, [(r, c, int(table[r][c]), number) for r, c, number in changes]
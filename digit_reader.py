@@ -1,18 +1,225 @@
 import cv2
 import numpy as np
-from matplotlib import pyplot as plt
-import tensorflow as tf
+from digit_backends import create_backend
+import instrumentation
 
 class DigitReader:
 
     IMG_SIZE = 34
+    GRID_SIZE = 9
+    INK_THRESHOLD = 70
+    MIN_INK_DENSITY = 10
+    # bound on how much centering and resizing can raise the ink sum of a cell
+    MAX_INK_GAIN = 4
+    CLASSES = 10
+    # temporal mode: weight of older predictions of a cell, a cell is stable after STABLE_FRAMES
+    # predictions with fused confidence of STABLE_CONFIDENCE and the model is not called for it
+    # until its content changes. A cell whose crop differs from the last one by less than
+    # CELL_CHANGE_THRESHOLD (mean absolute difference) is unchanged, otherwise its centered digit
+    # is compared with the one its predictions started with, so shifts of the warp do not count.
+    # When more than BOARD_CHANGE_CELLS cells change, all cells are reset as another board is seen.
+    # Every REFRESH_INTERVAL frames the stable cells are predicted again and reset if the prediction
+    # disagrees. At most FEW_CELLS cells are extracted one by one instead of the whole board
+    FUSION_DECAY = 0.7
+    STABLE_FRAMES = 3
+    STABLE_CONFIDENCE = 0.9
+    CELL_CHANGE_THRESHOLD = 12
+    DIGIT_CHANGE_THRESHOLD = 0.1
+    BOARD_CHANGE_CELLS = 20
+    REFRESH_INTERVAL = 30
+    FEW_CELLS = 8
 
-    def __init__(self):
-        self.model = tf.keras.models.load_model('tf-digits-model')
+    def __init__(self, backend='tensorflow', model_path=None, debug=False, batched_extraction=True, temporal=False):
+        """
+        backend is one of digit_backends.BACKENDS, 'opencv', 'onnx' and 'tflite' need the model
+        exported once with digit_backends.export_model. With debug every recognized cell is plotted.
+        batched_extraction processes all cells of a board with array operations, the result is the same
+        as of the per-cell path. With temporal the predictions of every cell are fused over frames
+        of the same board, read_numbers is then expected to get warps of consecutive video frames
+        """
+        self.backend = create_backend(backend, model_path)
+        self.debug = debug
+        self.batched_extraction = batched_extraction
+        self.temporal = temporal
         self.input = list()
         self.coords = list()
+        self.frame = 0
+        self.cell_crops = None
+        self.cell_digits = None
+        self.cell_inked = None
+        self.cell_scores = None
+        self.cell_frames = None
+        self.cells_predicted = 0
+        self.cells_skipped = 0
 
     def read_numbers(self, warp):
+        return self.read_numbers_with_confidence(warp)[0]
+
+    def read_numbers_with_confidence(self, warp):
+        if self.temporal:
+            return self.read_numbers_temporal(warp)
+        tables, confidences = self.read_numbers_batch_with_confidence([warp])
+        return tables[0], confidences[0]
+
+    def reset_temporal(self):
+        """ Forgets all cells, e.g. when another board is in front of the camera """
+        self.cell_crops = None
+
+    def read_numbers_temporal(self, warp):
+        """
+        Fuses the probabilities of every cell over frames, the model is called only for cells
+        which are not stable yet, whose content has changed or which are refreshed
+        """
+        n = self.GRID_SIZE
+        size = self.IMG_SIZE
+        self.frame += 1
+        crops = warp[:n * size, :n * size].reshape((n, size, n, size)).transpose((0, 2, 1, 3)).reshape((n * n, -1))
+        if self.cell_crops is None:
+            self.cell_crops = np.copy(crops)
+            self.cell_scores = np.zeros((n * n, self.CLASSES), np.float32)
+            self.cell_frames = np.zeros(n * n, np.int32)
+            self.cell_digits = np.zeros((n * n, 28 * 28), np.float32)
+            self.cell_inked = np.zeros(n * n, bool)
+            moved = np.ones(n * n, bool)
+        else:
+            moved = np.abs(crops.astype(np.int16) - self.cell_crops).mean(axis=1) > self.CELL_CHANGE_THRESHOLD
+        refresh = self.frame % self.REFRESH_INTERVAL == 0
+        if not refresh and not (moved | ~self.get_stable_cells()).any():
+            self.cells_skipped += n * n
+            instrumentation.count('cells_skipped', n * n)
+            return self.get_fused_table()
+
+        extracted = moved | ~self.get_stable_cells() if not refresh else np.ones(n * n, bool)
+        self.extract_cells(warp, extracted)
+        digits = np.zeros((n * n, 28 * 28), np.float32)
+        inked = np.zeros(n * n, bool)
+        cells = [r * n + c for r, c in self.coords]
+        for cell, filter_img in zip(cells, self.input):
+            digits[cell] = filter_img.ravel()
+            inked[cell] = True
+        changed = moved & ((inked != self.cell_inked) |
+                           (np.abs(digits - self.cell_digits).mean(axis=1) > self.DIGIT_CHANGE_THRESHOLD))
+        if np.count_nonzero(changed) > self.BOARD_CHANGE_CELLS:
+            changed = extracted
+        self.cell_crops[moved] = crops[moved]
+        self.reset_cells(changed, digits, inked)
+
+        update = ~self.get_stable_cells() | refresh
+        skipped = n * n - int(np.count_nonzero(update))
+        self.cells_skipped += skipped
+        instrumentation.count('cells_skipped', skipped)
+        # cells without ink are observed as empty for sure
+        observations = np.zeros((n * n, self.CLASSES), np.float32)
+        observations[:, 0] = 1
+        selected = [k for k, cell in enumerate(cells) if update[cell]]
+        if selected:
+            inputs = np.asarray([self.input[k] for k in selected], dtype=np.float32)
+            instrumentation.count('cells_classified', len(selected))
+            with instrumentation.timer('digit_inference'):
+                observations[[cells[k] for k in selected]] = self.softmax(self.predict(inputs))
+            self.cells_predicted += len(selected)
+        if refresh:
+            disagree = np.argmax(observations, axis=1) != np.argmax(self.cell_scores, axis=1)
+            self.reset_cells(disagree, digits, inked)
+        self.cell_scores[update] = self.cell_scores[update] * self.FUSION_DECAY + observations[update]
+        self.cell_frames[update] += 1
+        return self.get_fused_table()
+
+    def reset_cells(self, cells, digits, inked):
+        """ Starts fusion of the cells (boolean mask) again from their current digits """
+        self.cell_digits[cells] = digits[cells]
+        self.cell_inked[cells] = inked[cells]
+        self.cell_scores[cells] = 0
+        self.cell_frames[cells] = 0
+
+    def extract_cells(self, warp, cells):
+        """ Fills input and coords of the cells (boolean mask), few cells are read one by one """
+        if np.count_nonzero(cells) > self.FEW_CELLS:
+            self.extract_fields(warp)
+            return
+        size = self.IMG_SIZE
+        self.input = list()
+        self.coords = list()
+        for cell in np.nonzero(cells)[0]:
+            r, c = divmod(int(cell), self.GRID_SIZE)
+            self.read_field(warp[r * size:(r + 1) * size, c * size:(c + 1) * size], r, c)
+
+    def get_fused_table(self):
+        n = self.GRID_SIZE
+        table = np.argmax(self.cell_scores, axis=1).reshape((n, n)).tolist()
+        return table, self.get_confidences(table, self.get_fused_probabilities())
+
+    def get_fused_probabilities(self):
+        n = self.GRID_SIZE
+        totals = np.maximum(self.cell_scores.sum(axis=1, keepdims=True), 1e-6)
+        return (self.cell_scores / totals).reshape((n, n, self.CLASSES))
+
+    def get_fused_confidences(self):
+        return self.get_fused_probabilities().reshape((-1, self.CLASSES)).max(axis=1)
+
+    def get_stable_cells(self):
+        return (self.cell_frames >= self.STABLE_FRAMES) & (self.get_fused_confidences() >= self.STABLE_CONFIDENCE)
+
+    def read_numbers_batch(self, warps):
+        """
+        Reads tables from warped boards of many images or frames with one inference call
+        for all non-empty cells
+        """
+        return self.read_numbers_batch_with_confidence(warps)[0]
+
+    @instrumentation.timed('read_digits')
+    def read_numbers_batch_with_confidence(self, warps):
+        """
+        Same as read_numbers_batch, also returns for every board a table of the model's probabilities
+        of the read digits, cells found empty have None
+        """
+        tables, probabilities = self.read_numbers_batch_with_probabilities(warps)
+        return tables, [self.get_confidences(table, board_probabilities)
+                        for table, board_probabilities in zip(tables, probabilities)]
+
+    def read_numbers_batch_with_probabilities(self, warps):
+        """
+        Same as read_numbers_batch, also returns for every board an array (rows, columns, CLASSES)
+        of the probabilities of all digits, cells found empty are empty for sure
+        """
+        tables = list()
+        probabilities = np.zeros((len(warps), self.GRID_SIZE, self.GRID_SIZE, self.CLASSES), np.float32)
+        probabilities[:, :, :, 0] = 1
+        inputs = list()
+        coords = list()
+        for board_index, warp in enumerate(warps):
+            tables.append(self.extract_fields(warp))
+            inputs += self.input
+            coords += [(board_index, r, c) for r, c in self.coords]
+
+        instrumentation.count('cells_classified', len(inputs))
+        if len(inputs) == 0:
+            return tables, list(probabilities)
+        with instrumentation.timer('digit_inference'):
+            predictions = self.softmax(self.predict(np.asarray(inputs, dtype=np.float32)))
+        for (board_index, r, c), prediction in zip(coords, predictions):
+            tables[board_index][r][c] = int(np.argmax(prediction))
+            probabilities[board_index, r, c] = prediction
+
+        return tables, list(probabilities)
+
+    def read_numbers_with_probabilities(self, warp):
+        if self.temporal:
+            table, _ = self.read_numbers_temporal(warp)
+            return table, self.get_fused_probabilities()
+        tables, probabilities = self.read_numbers_batch_with_probabilities([warp])
+        return tables[0], probabilities[0]
+
+    @staticmethod
+    def get_confidences(table, probabilities):
+        """ Probabilities of the read digits, None for empty cells """
+        return [[float(probabilities[r, c, number]) if number != 0 else None for c, number in enumerate(row)]
+                for r, row in enumerate(table)]
+
+    def extract_fields(self, warp):
+        if self.batched_extraction:
+            return self.extract_fields_batched(warp)
+
         crop_size = (self.IMG_SIZE, self.IMG_SIZE)
         table = list()
         self.input = list()
@@ -24,28 +231,86 @@ class DigitReader:
                             int(crop_size[1] * j): int(crop_size[1] * (j + 1))]
                 row.append(self.read_field(crop, i, j))
             table.append(row)
+        return table
+
+    def extract_fields_batched(self, warp):
+        size = self.IMG_SIZE
+        n = self.GRID_SIZE
+        stride = size + 1
+        table = [[0] * n for _ in range(n)]
+        self.input = list()
+        self.coords = list()
 
-        predictions = self.model.predict(np.asarray(self.input))
-        index = 0
-        for r, c in self.coords:
-            table[r][c] = np.argmax(predictions[index])
-            index += 1
+        # cells are copied to a board with one pixel gaps, so one labeling pass never joins
+        # components of neighbouring cells. filter_borders passes 4 as the labels argument,
+        # so the per-cell path labels with the default 8-connectivity
+        board = np.zeros((n, stride, n, stride), np.uint8)
+        board[:, :size, :, :size] = 255 - warp[:n * size, :n * size].reshape((n, size, n, size))
+        _, board_labels = cv2.connectedComponents(board.reshape((n * stride, n * stride)), connectivity=8)
+        labels = board_labels.reshape((n, stride, n, stride))[:, :size, :, :size]
+        labels = labels.transpose((0, 2, 1, 3)).reshape((n * n, size, size))
+        cells = board[:, :size, :, :size].transpose((0, 2, 1, 3)).reshape((n * n, size, size))
 
+        # same scan order as find_center_label, 0 means no label in the center
+        window = labels[:, 12:24, 12:24].reshape((n * n, -1))
+        center_labels = window[np.arange(n * n), np.argmax(window != 0, axis=1)]
+        masks = (labels == center_labels[:, None, None]) & (center_labels != 0)[:, None, None]
+        fields = cells * masks
+
+        ink = fields.sum(axis=(1, 2), dtype=np.int64)
+        candidates = np.nonzero(ink * self.MAX_INK_GAIN >= self.MIN_INK_DENSITY * size * size)[0]
+        if len(candidates) == 0:
+            return table
+
+        masks = masks[candidates]
+        areas = masks.sum(axis=(1, 2), dtype=np.int64)
+        positions = np.arange(size)
+        centers_x = (masks * positions[None, None, :]).sum(axis=(1, 2), dtype=np.int64) / areas
+        centers_y = (masks * positions[None, :, None]).sum(axis=(1, 2), dtype=np.int64) / areas
+        centered = np.stack([self.center_pic(fields[cell], (center_x, center_y))
+                             for cell, center_x, center_y in zip(candidates, centers_x, centers_y)], axis=2)
+
+        # every candidate is one channel, so all of them are resized by a single call
+        resized = cv2.resize(centered[4:30, 4:30], (28, 28)).reshape((28, 28, len(candidates)))
+        resized = np.where(resized > self.INK_THRESHOLD, resized, 0).astype(np.uint8)
+        densities = resized.sum(axis=(0, 1), dtype=np.int64) / (size * size)
+        for k in np.nonzero(densities >= self.MIN_INK_DENSITY)[0]:
+            r, c = divmod(int(candidates[k]), n)
+            filter_img = resized[:, :, k]
+            if self.debug:
+                self.show_field(filter_img)
+            self.input.append(filter_img * 1.0 / 255)
+            self.coords.append((r, c))
         return table
 
+    def predict(self, x):
+        return self.backend.predict(x)
+
+    @staticmethod
+    def softmax(logits):
+        """ The model ends with a linear layer, probabilities of digits are its softmax """
+        exp = np.exp(logits - np.max(logits, axis=1, keepdims=True))
+        return exp / np.sum(exp, axis=1, keepdims=True)
+
     def read_field(self, crop, r, c):
         filter_img = self.filter_borders(crop)
         filter_img = self.cut_img_padding(filter_img)
         filter_img = cv2.threshold(filter_img, 70, 255, cv2.THRESH_TOZERO)[1]
         if np.sum(filter_img) / (len(crop)**2) < 10:
             return 0
-        #plt.imshow(filter_img, 'gray')
-        #plt.show()
+        if self.debug:
+            self.show_field(filter_img)
 
         self.input.append(filter_img * 1.0 / 255)
         self.coords.append((r, c))
         return 0
 
+    @staticmethod
+    def show_field(field):
+        from matplotlib import pyplot as plt
+        plt.imshow(field, 'gray')
+        plt.show()
+
     @staticmethod
     def cut_img_padding(crop):
         return cv2.resize(crop[4:30, 4:30], (28, 28))
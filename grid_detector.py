@@ -3,28 +3,121 @@ import cv2
 from line_detector import LineDetector
 from point_finder import PointsFinder
 from corner_finder import CornerFinder
+import instrumentation
 
 
 class GridDetector:
+    # thresholds below are tuned for images of this size, other sizes scale them
+    REFERENCE_SIZE = 400
+    THRESHOLD_BLOCK_SIZE = 57
+    THRESHOLD_C = 5
+    # the block mean weighs the whole block alike, a smaller block follows the Gaussian closer
+    FAST_THRESHOLD_BLOCK_SIZE = 15
+    FAST_THRESHOLD_C = 7
+    MIN_CONTOUR_AREA = 1500
 
-    def __init__(self):
-        self.line_detector = LineDetector()
+    DETECTION_SIZE = 200
+    REFINE_SAMPLES = (0.3, 0.7)
+    REFINE_MIN_CONTRAST = 40
+    REFINE_MIN_SAMPLES = 6
+    # refined corners are a grid when convex, with angles at most this many degrees from square
+    # and opposite sides of similar length
+    REFINE_MAX_ANGLE_ERROR = 25
+    REFINE_MIN_SIDE_RATIO = 0.6
+
+    # part of the grid size added around the last corners in ROI mode
+    ROI_MARGIN = 0.25
+
+    PREPROCESS_GAUSSIAN = 'gaussian'
+    PREPROCESS_FAST = 'fast'
+
+    def __init__(self, line_merge_mode=LineDetector.MERGE_GREEDY, scale=1.0, use_roi=False,
+                 preprocess_mode=PREPROCESS_GAUSSIAN):
+        """
+        scale is size of the processed images relative to REFERENCE_SIZE. With use_roi only the area
+        around the last found corners is processed, the whole image when that fails. thresh_image
+        then covers the area only and thresh_offset is its position in the image.
+        The fast preprocess_mode thresholds by the mean of the block into buffers reused between frames
+        and removes small components by one labeling pass, thresh_image is overwritten by the next frame
+        """
+        if preprocess_mode not in (self.PREPROCESS_GAUSSIAN, self.PREPROCESS_FAST):
+            raise ValueError('Unknown preprocess mode: {}'.format(preprocess_mode))
+        self.line_merge_mode = line_merge_mode
+        self.use_roi = use_roi
+        self.preprocess_mode = preprocess_mode
+        self.gray_buffer = None
+        self.thresh_buffer = None
         self.thresh_image = None
+        self.thresh_offset = np.zeros(2, dtype=np.float32)
+        self.reference_thresh = None
+        self.last_corners = None
+        self.scale = None
+        self.set_scale(scale)
+
+    def set_scale(self, scale):
+        if scale == self.scale:
+            return
+        self.scale = scale
+        self.line_detector = LineDetector(self.line_merge_mode, scale)
+        self.block_size = max(3, int(round(self.THRESHOLD_BLOCK_SIZE * scale)) | 1)
+        self.fast_block_size = max(3, int(round(self.FAST_THRESHOLD_BLOCK_SIZE * scale)) | 1)
+        self.min_contour_area = self.MIN_CONTOUR_AREA * scale * scale
+        self.crossing_space = int(round(PointsFinder.CROSSING_SPACE * max(1.0, scale)))
 
+    @instrumentation.timed('find_grid')
     def find_grid(self, image, show_img=True):
+        if self.use_roi and self.last_corners is not None:
+            x, y, width, height = self.get_roi(image.shape, self.last_corners)
+            corners = self.find_grid_in_image(image[y:y + height, x:x + width], show_img)
+            if corners is not None:
+                instrumentation.outcome('roi', 'hit')
+                self.thresh_offset = np.float32([x, y])
+                self.last_corners = corners + self.thresh_offset
+                return self.last_corners
+            instrumentation.outcome('roi', 'miss')
+
+        self.last_corners = self.find_grid_in_image(image, show_img)
+        self.thresh_offset = np.zeros(2, dtype=np.float32)
+        return self.last_corners
+
+    def get_roi(self, shape, corners):
+        """
+        Returns x, y, width, height of the bounding box of corners expanded by ROI_MARGIN, but at least
+        by the threshold block, so the grid is thresholded the same as in the whole image
+        """
+        top_left = corners.min(axis=0)
+        bottom_right = corners.max(axis=0)
+        margin = np.maximum((bottom_right - top_left) * self.ROI_MARGIN, self.block_size)
+        x0, y0 = np.maximum(np.floor(top_left - margin), 0).astype(int)
+        x1 = int(min(np.ceil(bottom_right[0] + margin[0]), shape[1]))
+        y1 = int(min(np.ceil(bottom_right[1] + margin[1]), shape[0]))
+        return x0, y0, max(x1 - x0, 1), max(y1 - y0, 1)
+
+    def update_thresh_image(self, image, corners):
+        """ Thresholds image for warping grid with corners found without detection, e.g. tracked """
+        x, y, width, height = 0, 0, image.shape[1], image.shape[0]
+        if self.use_roi:
+            x, y, width, height = self.get_roi(image.shape, corners)
+            self.last_corners = np.float32(corners)
+        self.thresh_image = self.preprocess_image(image[y:y + height, x:x + width])
+        self.thresh_offset = np.float32([x, y])
+
+    def find_grid_in_image(self, image, show_img=True):
         self.thresh_image = self.preprocess_image(image)
         filtered_image = self.filter_small_contours(self.thresh_image)
 
         lines = self.line_detector.find_lines(filtered_image)
         if lines is None:
+            instrumentation.outcome('find_grid', 'no_lines')
             return None
 
-        points_finder = PointsFinder(filtered_image, lines)
+        points_finder = PointsFinder(filtered_image, lines, crossing_space=self.crossing_space)
         points = points_finder.get_points()
         lines_with_points = points_finder.get_lines_with_points()
 
         corner_finder = CornerFinder()
         final_corners = corner_finder.estimate_corners(lines_with_points)
+        instrumentation.outcome('find_grid', 'no_corners' if final_corners is None else 'found')
 
         if show_img:
             colored_image = self.draw_image(filtered_image, lines, points, corner_finder.get_middle_lines_ids(),
@@ -33,6 +126,120 @@ class GridDetector:
 
         return final_corners
 
+    def find_grid_coarse_to_fine(self, image, detection_size=DETECTION_SIZE, show_img=True, reference_image=None):
+        """
+        Finds the grid on image shrunk to detection_size with thresholds scaled to it and refines
+        the corners on the full image. When no grid is found there or the refined corners are not
+        a plausible grid, the grid is searched on image shrunk to REFERENCE_SIZE with unscaled thresholds.
+        reference_image is that shrunk image when the caller has made it already. Returns corners
+        in image coordinates, thresh_image stays in the size of the last search
+        """
+        self.reference_thresh = None
+        small = self.shrink_image(image, detection_size)
+        corners = self.find_grid_in_copy(small, image.shape, max(small.shape[:2]) / self.REFERENCE_SIZE, show_img)
+        if corners is not None:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            search_radius = 3 * image.shape[1] / small.shape[1] + 2
+            corners = self.refine_corners(gray, corners, search_radius)
+            if self.is_plausible_grid(corners):
+                instrumentation.outcome('coarse_to_fine', 'refined')
+                return corners
+
+        instrumentation.outcome('coarse_to_fine', 'fallback')
+        if reference_image is None:
+            reference_image = self.shrink_image(image, self.REFERENCE_SIZE)
+        corners = self.find_grid_in_copy(reference_image, image.shape, 1.0, show_img)
+        if self.preprocess_mode == self.PREPROCESS_GAUSSIAN and self.thresh_image.shape == reference_image.shape[:2]:
+            self.reference_thresh = reference_image, self.thresh_image
+        return corners
+
+    def find_grid_in_copy(self, copy, shape, scale, show_img):
+        """ Finds the grid on a resized copy of an image of shape, returns corners in the image coordinates """
+        self.set_scale(scale)
+        corners = self.find_grid(copy, show_img)
+        if corners is None:
+            return None
+        return corners * np.float32([shape[1] / copy.shape[1], shape[0] / copy.shape[0]])
+
+    def threshold_reference_image(self, reference_image):
+        """
+        Thresholds the image shrunk to REFERENCE_SIZE as threshold_image does, the threshold made by
+        the last find_grid_coarse_to_fine is reused when it searched the same image
+        """
+        if self.reference_thresh is not None and self.reference_thresh[0] is reference_image:
+            return self.reference_thresh[1]
+        return self.threshold_image(reference_image)
+
+    @staticmethod
+    def shrink_image(image, size):
+        height, width = image.shape[:2]
+        ratio = min(1.0, size / max(height, width))
+        return cv2.resize(image, (max(1, int(width * ratio)), max(1, int(height * ratio))),
+                          interpolation=cv2.INTER_AREA)
+
+    @staticmethod
+    def is_plausible_grid(corners):
+        corners = np.float32(corners)
+        if not cv2.isContourConvex(corners.reshape((-1, 1, 2))):
+            return False
+        sides = np.roll(corners, -1, axis=0) - corners
+        lengths = np.linalg.norm(sides, axis=1)
+        if lengths.min() < 1:
+            return False
+        ratios = np.minimum(lengths[:2], lengths[2:]) / np.maximum(lengths[:2], lengths[2:])
+        cosines = np.abs((sides * np.roll(sides, 1, axis=0)).sum(axis=1)) / (lengths * np.roll(lengths, 1))
+        return ratios.min() >= GridDetector.REFINE_MIN_SIDE_RATIO \
+            and cosines.max() <= np.sin(np.radians(GridDetector.REFINE_MAX_ANGLE_ERROR))
+
+    @staticmethod
+    @instrumentation.timed('refine_corners')
+    def refine_corners(gray, corners, search_radius):
+        """
+        Moves each border line of the grid to the center of the dark band found across it near
+        the middle of every cell, fits the line through the centers and intersects the neighbouring
+        lines. Lines without enough clear samples keep their position, corners which would move
+        further than search_radius are kept too
+        """
+        corners = np.float32(corners)
+        fitted_lines = list()
+        for start, end in zip(corners, np.roll(corners, -1, axis=0)):
+            direction = end - start
+            length = np.linalg.norm(direction)
+            normal = np.float32([-direction[1], direction[0]]) / max(length, 1e-6)
+            radius = int(min(search_radius, length / 9 / 4))
+            positions = (np.arange(9)[:, None] + np.float32(GridDetector.REFINE_SAMPLES)).reshape(-1) / 9
+            samples = start + positions[:, None] * direction
+            offsets = np.arange(-radius, radius + 1, dtype=np.float32)
+            probes = (samples[:, None, :] + offsets[None, :, None] * normal).astype(np.float32)
+            profiles = cv2.remap(gray, probes, None, cv2.INTER_LINEAR,
+                                 borderMode=cv2.BORDER_REPLICATE).astype(np.float32)
+
+            # only dark bands with bright pixels on both sides are used
+            darkest = profiles.min(axis=1, keepdims=True)
+            middle = darkest + (profiles.max(axis=1, keepdims=True) - darkest) / 2
+            weights = np.maximum(middle - profiles, 0)
+            valid = (np.minimum(profiles[:, 0], profiles[:, -1]) - darkest[:, 0] >= GridDetector.REFINE_MIN_CONTRAST) \
+                & (weights.sum(axis=1) > 0)
+            if np.count_nonzero(valid) < GridDetector.REFINE_MIN_SAMPLES:
+                fitted_lines.append((direction / max(length, 1e-6), start))
+                continue
+            shifts = (weights[valid] * offsets).sum(axis=1) / weights[valid].sum(axis=1)
+            centers = samples[valid] + shifts[:, None] * normal
+            vx, vy, x0, y0 = cv2.fitLine(centers, cv2.DIST_HUBER, 0, 0.01, 0.01).reshape(-1)
+            fitted_lines.append((np.float32([vx, vy]), np.float32([x0, y0])))
+
+        refined = np.copy(corners)
+        for i in range(4):
+            (d1, p1), (d2, p2) = fitted_lines[i - 1], fitted_lines[i]
+            determinant = d1[0] * d2[1] - d1[1] * d2[0]
+            if abs(determinant) < 1e-6:
+                continue
+            t = ((p2[0] - p1[0]) * d2[1] - (p2[1] - p1[1]) * d2[0]) / determinant
+            corner = p1 + t * d1
+            if np.linalg.norm(corner - corners[i]) <= search_radius:
+                refined[i] = corner
+        return refined
+
     def draw_image(self, thresh, lines, points, middle_lines, border_lines):
         colored_image = cv2.cvtColor(thresh, cv2.COLOR_GRAY2BGR)
         self.draw_lines(colored_image, lines, middle_lines, border_lines)
@@ -40,29 +247,63 @@ class GridDetector:
 
         return colored_image
 
+    @instrumentation.timed('threshold')
+    def preprocess_image(self, raw_image):
+        if self.preprocess_mode == self.PREPROCESS_FAST:
+            return self.threshold_image_fast(raw_image)
+        return self.threshold_image(raw_image, self.block_size)
+
+    def threshold_image_fast(self, raw_image):
+        shape = raw_image.shape[:2]
+        if self.gray_buffer is None or self.gray_buffer.shape != shape:
+            self.gray_buffer = np.empty(shape, np.uint8)
+            self.thresh_buffer = np.empty(shape, np.uint8)
+        cv2.cvtColor(raw_image, cv2.COLOR_BGR2GRAY, dst=self.gray_buffer)
+        cv2.adaptiveThreshold(self.gray_buffer, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY,
+                              self.fast_block_size, self.FAST_THRESHOLD_C, dst=self.thresh_buffer)
+        return self.thresh_buffer
+
     @staticmethod
-    def preprocess_image(raw_image):
+    def threshold_image(raw_image, block_size=THRESHOLD_BLOCK_SIZE):
         gray = cv2.cvtColor(raw_image, cv2.COLOR_BGR2GRAY)
-        return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 57, 5)
+        return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+                                     block_size, GridDetector.THRESHOLD_C)
+
+    @instrumentation.timed('filter_contours')
+    def filter_small_contours(self, thresh):
+        if self.preprocess_mode == self.PREPROCESS_FAST:
+            return self.filter_small_components(thresh)
 
-    @staticmethod
-    def filter_small_contours(thresh):
         thresh = np.copy(thresh)
         cnts = cv2.findContours(thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
         cnts = cnts[0] if len(cnts) == 2 else cnts[1]
         for c in cnts:
             area = cv2.contourArea(c)
-            if area < 1500:
+            if area < self.min_contour_area:
                 cv2.drawContours(thresh, [c], -1, 255, -1)
 
         return 255 - thresh
 
+    def filter_small_components(self, thresh):
+        """
+        Same as filter_small_contours, which fills small holes of the white background. Dark components
+        (4-connected, as holes of findContours) smaller than the contour area are removed, except those
+        touching the image border, which are not holes
+        """
+        ink = cv2.bitwise_not(thresh)
+        _, labels, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=4)
+        left = stats[:, cv2.CC_STAT_LEFT]
+        top = stats[:, cv2.CC_STAT_TOP]
+        touches_border = (left == 0) | (top == 0) | (left + stats[:, cv2.CC_STAT_WIDTH] == thresh.shape[1]) \
+            | (top + stats[:, cv2.CC_STAT_HEIGHT] == thresh.shape[0])
+        lookup = np.where((stats[:, cv2.CC_STAT_AREA] >= self.min_contour_area) | touches_border, 255, 0)
+        lookup[0] = 0
+        return np.take(lookup.astype(np.uint8), labels)
+
     @staticmethod
     def draw_lines(colored_image, lines, middle_lines_id, border_lines_id):
         line_id = 0
-        for line in lines:
-            rho = line[0][0]
-            theta = line[0][1]
+        for rho, theta in np.asarray(lines).reshape((-1, 2)):
             a = np.cos(theta)
             b = np.sin(theta)
             x0 = a * rho
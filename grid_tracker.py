@@ -0,0 +1,98 @@
+import cv2
+import numpy as np
+
+
+class GridTracker:
+    """
+    Follows grid corners between frames. Keypoints inside the grid are tracked with sparse
+    optical flow and the corners are moved by the homography estimated from them
+    """
+
+    MAX_FEATURES = 120
+    FEATURES_QUALITY = 0.01
+    FEATURES_MIN_DISTANCE = 5
+    MIN_TRACKED_POINTS = 12
+    MIN_INLIER_RATIO = 0.7
+    RANSAC_THRESHOLD = 3.0
+    FLOW_WINDOW = (21, 21)
+    FLOW_LEVELS = 3
+    REDETECT_INTERVAL = 30
+
+    def __init__(self, redetect_interval=REDETECT_INTERVAL):
+        self.redetect_interval = redetect_interval
+        self.prev_gray = None
+        self.points = None
+        self.corners = None
+        self.frames_since_detection = 0
+        self.confidence = 0.0
+
+    def reset(self):
+        self.prev_gray = None
+        self.points = None
+        self.corners = None
+        self.frames_since_detection = 0
+        self.confidence = 0.0
+
+    def is_tracking(self):
+        return self.corners is not None
+
+    def start(self, gray, corners):
+        """ Starts tracking from corners found by full detection in gray frame """
+        mask = np.zeros_like(gray)
+        cv2.fillConvexPoly(mask, corners.astype(np.int32), 255)
+        points = cv2.goodFeaturesToTrack(gray, self.MAX_FEATURES, self.FEATURES_QUALITY,
+                                         self.FEATURES_MIN_DISTANCE, mask=mask)
+        if points is None or len(points) < self.MIN_TRACKED_POINTS:
+            self.reset()
+            return
+        self.prev_gray = gray
+        self.points = points
+        self.corners = np.float32(corners)
+        self.frames_since_detection = 0
+        self.confidence = 1.0
+
+    def track(self, gray):
+        """
+        Returns corners moved to gray frame, or None when the grid should be detected again
+        (nothing tracked, frame size changed, too few points followed, low homography support
+        or periodic re-detection)
+        """
+        if not self.is_tracking() or self.frames_since_detection >= self.redetect_interval:
+            self.reset()
+            return None
+        if gray.shape != self.prev_gray.shape:
+            self.reset()
+            return None
+
+        next_points, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, self.points, None,
+                                                          winSize=self.FLOW_WINDOW, maxLevel=self.FLOW_LEVELS)
+        if next_points is None:
+            self.reset()
+            return None
+        status = status.reshape(-1) == 1
+        old_points = self.points[status]
+        new_points = next_points[status]
+        if len(new_points) < self.MIN_TRACKED_POINTS:
+            self.reset()
+            return None
+
+        homography, inliers = cv2.findHomography(old_points, new_points, cv2.RANSAC, self.RANSAC_THRESHOLD)
+        if homography is None:
+            self.reset()
+            return None
+        inliers = inliers.reshape(-1) == 1
+        self.confidence = np.count_nonzero(inliers) / len(self.points)
+        if self.confidence < self.MIN_INLIER_RATIO:
+            self.reset()
+            return None
+
+        corners = cv2.perspectiveTransform(self.corners.reshape((-1, 1, 2)), homography).reshape((4, 2))
+        if not cv2.isContourConvex(corners):
+            self.reset()
+            return None
+
+        self.corners = np.float32(corners)
+        self.points = new_points[inliers].reshape((-1, 1, 2))
+        self.prev_gray = gray
+        self.frames_since_detection += 1
+        return self.corners
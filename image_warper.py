@@ -1,24 +1,45 @@
 import cv2
 import numpy as np
+import instrumentation
 
 
 class ImageWarper:
     WARP_PIC_SIZE = 306
+    NUMBER_COLOR = (255, 55, 0)
+    DEBUG_NUMBER_COLOR = (128, 0, 255)
+    # numbers drawn as in write_number_to_image, rendered once for all warpers
+    glyphs = None
 
     def __init__(self):
         self.points = None
         self.dst = None
+        self.matrix = None
+        self.numbers_key = None
+        self.numbers = None
 
-    def warp(self, image, points):
+    def set_points(self, points, matrix=None):
         self.points = points
-        dst = np.array([
+        self.matrix = matrix
+        self.dst = np.array([
             [0, 0],
             [self.WARP_PIC_SIZE - 1, 0],
             [self.WARP_PIC_SIZE - 1, self.WARP_PIC_SIZE - 1],
             [0, self.WARP_PIC_SIZE - 1]], dtype="float32")
-        self.dst = dst
 
-        M = cv2.getPerspectiveTransform(points, dst)
+    def get_matrix(self):
+        """ Homography from the original image to the warp, computed once for the points """
+        if self.matrix is None:
+            self.matrix = cv2.getPerspectiveTransform(np.float32(self.points), self.dst)
+        return self.matrix
+
+    def move_points(self, points, transform):
+        """ Sets points of the image the warped image was made from by the 3x3 transform, keeps the homography """
+        self.set_points(points, self.get_matrix() @ transform)
+
+    @instrumentation.timed('warp')
+    def warp(self, image, points):
+        self.set_points(points)
+        M = self.get_matrix()
         warp = cv2.warpPerspective(image, M, (self.WARP_PIC_SIZE, self.WARP_PIC_SIZE))
         return warp
 
@@ -43,7 +64,71 @@ class ImageWarper:
         dst = cv2.add(img1_bg, fg)
         return dst
 
-    def write_number_to_image(self, image, table, new_table):
+    @staticmethod
+    def get_glyphs():
+        if ImageWarper.glyphs is None:
+            cell_size = int(ImageWarper.WARP_PIC_SIZE / 9)
+            glyphs = np.zeros((10, cell_size, cell_size), np.uint8)
+            for number in range(1, 10):
+                cv2.putText(glyphs[number], str(number), (8, cell_size - 8), cv2.FONT_HERSHEY_SIMPLEX, 0.8, 255, 1,
+                            cv2.LINE_AA)
+            ImageWarper.glyphs = glyphs
+        return ImageWarper.glyphs
+
+    def render_numbers(self, table, new_table):
+        """
+        Returns the same image of the added numbers as write_number_to_image, made of cached glyphs.
+        It is kept until the tables change
+        """
+        key = (tuple(map(tuple, table)), tuple(map(tuple, new_table)))
+        if key == self.numbers_key:
+            return self.numbers
+
+        glyphs = self.get_glyphs()
+        cell_size = glyphs.shape[1]
+        numbers = np.zeros((self.WARP_PIC_SIZE, self.WARP_PIC_SIZE), np.uint8)
+        for i in range(len(table)):
+            for j in range(len(table[i])):
+                if new_table[i][j] != 0 and table[i][j] == 0:
+                    numbers[cell_size * i:cell_size * (i + 1), cell_size * j:cell_size * (j + 1)] = \
+                        glyphs[new_table[i][j]]
+        self.numbers_key = key
+        self.numbers = numbers
+        return numbers
+
+    def show_numbers(self, image, numbers):
+        """ Debug view of the warp with added numbers, not called on the rendering path """
+        im = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+        im[numbers > 0] = self.DEBUG_NUMBER_COLOR
+        cv2.imshow('nums', im)
+
+    @instrumentation.timed('render')
+    def draw_numbers_to_original(self, numbers, original):
+        """
+        Same result as draw_warp_to_original, only the bounding box of the grid is unwarped
+        by the homography of the last warp and composited in place of the copy
+        """
+        result = original.copy()
+        height, width = original.shape[:2]
+        x0, y0 = np.maximum(np.floor(np.min(self.points, axis=0)), 0).astype(int)
+        x1 = int(min(np.ceil(np.max(self.points[:, 0])) + 1, width))
+        y1 = int(min(np.ceil(np.max(self.points[:, 1])) + 1, height))
+        if x1 <= x0 or y1 <= y0:
+            return result
+
+        # maps pixels of the box to the warp, so no inverse matrix is needed
+        shift = np.float64([[1, 0, x0], [0, 1, y0], [0, 0, 1]])
+        box_numbers = cv2.warpPerspective(numbers, self.get_matrix() @ shift, (x1 - x0, y1 - y0),
+                                          flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP)
+        box = result[y0:y1, x0:x1]
+        # as merge_pics: strong pixels get the color, faint ones are added to the original
+        _, strong = cv2.threshold(box_numbers, 10, 255, cv2.THRESH_BINARY)
+        _, drawn = cv2.threshold(box_numbers, 0, 255, cv2.THRESH_BINARY)
+        cv2.subtract(box, (255, 255, 255, 0), dst=box, mask=strong)
+        cv2.add(box, self.NUMBER_COLOR + (0,), dst=box, mask=drawn)
+        return result
+
+    def write_number_to_image(self, image, table, new_table, show_img=True):
         img_with_numbers = np.zeros((image.shape[1], image.shape[0]), np.uint8)
         im = cv2.cvtColor(image,cv2.COLOR_GRAY2RGB)
         font = cv2.FONT_HERSHEY_SIMPLEX
@@ -54,5 +139,6 @@ class ImageWarper:
                     cv2.putText(img_with_numbers, str(new_table[i][j]), (cell_size*j + 8, cell_size*(i+1)-8), font, 0.8, 255, 1, cv2.LINE_AA)
                     cv2.putText(im, str(new_table[i][j]), (cell_size*j + 8, cell_size*(i+1)-8), font, 0.8, (128, 0, 255), 2, cv2.LINE_AA)
 
-        cv2.imshow('nums', im)
+        if show_img:
+            cv2.imshow('nums', im)
         return img_with_numbers
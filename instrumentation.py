@@ -0,0 +1,240 @@
+import bisect
+import functools
+import json
+import threading
+import time
+from collections import Counter
+
+# upper bounds of time buckets in seconds, the last one takes everything
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, float('inf'))
+
+_sink = None
+
+
+def enable(sink):
+    """ Sends stage times, counters and outcomes to the sink until disable() """
+    global _sink
+    _sink = sink
+
+
+def disable():
+    global _sink
+    _sink = None
+
+
+def is_enabled():
+    return _sink is not None
+
+
+class _NullTimer:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ('sink', 'stage', 'start')
+
+    def __init__(self, sink, stage):
+        self.sink = sink
+        self.stage = stage
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.sink.add_time(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+def timer(stage):
+    """ Context manager measuring the stage, a shared no-op one while disabled """
+    sink = _sink
+    if sink is None:
+        return _NULL_TIMER
+    return _Timer(sink, stage)
+
+
+def timed(stage):
+    """ Decorator measuring every call of the function as the stage """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            sink = _sink
+            if sink is None:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                sink.add_time(stage, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def count(name, value=1):
+    sink = _sink
+    if sink is not None:
+        sink.add_count(name, value)
+
+
+def outcome(stage, reason):
+    """ Records how the stage ended, e.g. ('find_grid', 'no_lines') or ('solve', 'solved') """
+    sink = _sink
+    if sink is not None:
+        sink.add_outcome(stage, reason)
+
+
+class HistogramSink:
+    """ Keeps histograms of stage times, totals of counters and counts of outcomes in memory """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.histograms = dict()
+        self.sums = Counter()
+        self.maxima = dict()
+        self.counters = Counter()
+        self.outcomes = Counter()
+
+    def add_time(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = [0] * len(self.buckets)
+            histogram[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.sums[stage] += seconds
+            self.maxima[stage] = max(self.maxima.get(stage, 0.0), seconds)
+
+    def add_count(self, name, value):
+        with self.lock:
+            self.counters[name] += value
+
+    def add_outcome(self, stage, reason):
+        with self.lock:
+            self.outcomes[(stage, reason)] += 1
+
+    def get_percentile(self, stage, percentile):
+        """ Estimate in seconds, interpolated inside the bucket with the percentile """
+        histogram = self.histograms[stage]
+        rank = percentile / 100 * sum(histogram)
+        total = 0
+        lower = 0.0
+        for bound, bucket_count in zip(self.buckets, histogram):
+            upper = min(bound, self.maxima[stage])
+            if bucket_count > 0 and total + bucket_count >= rank:
+                return lower + (upper - lower) * (rank - total) / bucket_count
+            total += bucket_count
+            lower = upper
+        return self.maxima[stage]
+
+    def summary(self):
+        with self.lock:
+            stages = {stage: {'count': sum(histogram), 'mean_ms': self.sums[stage] * 1000 / sum(histogram),
+                              'p50_ms': self.get_percentile(stage, 50) * 1000,
+                              'p99_ms': self.get_percentile(stage, 99) * 1000,
+                              'max_ms': self.maxima[stage] * 1000}
+                      for stage, histogram in self.histograms.items()}
+            return {'stages': stages, 'counters': dict(self.counters),
+                    'outcomes': {'{}.{}'.format(stage, reason): value
+                                 for (stage, reason), value in self.outcomes.items()}}
+
+    def format(self):
+        summary = self.summary()
+        lines = ['{:<20} {:>7} {:>9} {:>9} {:>9} {:>9}'.format('stage', 'count', 'mean ms', 'p50 ms', 'p99 ms',
+                                                               'max ms')]
+        for stage, values in sorted(summary['stages'].items()):
+            lines.append('{:<20} {:>7} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f}'.format(
+                stage, values['count'], values['mean_ms'], values['p50_ms'], values['p99_ms'], values['max_ms']))
+        for name, value in sorted(summary['counters'].items()):
+            lines.append('{:<20} {:>7}'.format(name, value))
+        for name, value in sorted(summary['outcomes'].items()):
+            lines.append('{:<20} {:>7}'.format(name, value))
+        return '\n'.join(lines)
+
+
+class PrometheusSink(HistogramSink):
+    """ HistogramSink exported in the Prometheus text format """
+
+    def __init__(self, prefix='sudoku', buckets=BUCKETS):
+        super().__init__(buckets)
+        self.prefix = prefix
+
+    def export(self):
+        name = self.prefix + '_stage_seconds'
+        lines = ['# TYPE {} histogram'.format(name)]
+        with self.lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                total = 0
+                for bound, bucket_count in zip(self.buckets, histogram):
+                    total += bucket_count
+                    lines.append('{}_bucket{{stage="{}",le="{}"}} {}'.format(
+                        name, stage, '+Inf' if bound == float('inf') else bound, total))
+                lines.append('{}_sum{{stage="{}"}} {}'.format(name, stage, self.sums[stage]))
+                lines.append('{}_count{{stage="{}"}} {}'.format(name, stage, total))
+
+            lines.append('# TYPE {}_events_total counter'.format(self.prefix))
+            for counter_name, value in sorted(self.counters.items()):
+                lines.append('{}_events_total{{name="{}"}} {}'.format(self.prefix, counter_name, value))
+            lines.append('# TYPE {}_outcomes_total counter'.format(self.prefix))
+            for (stage, reason), value in sorted(self.outcomes.items()):
+                lines.append('{}_outcomes_total{{stage="{}",reason="{}"}} {}'.format(self.prefix, stage, reason,
+                                                                                     value))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            f.write(self.export())
+
+
+class JsonlSink:
+    """ Writes every measurement as one JSON line, times in milliseconds """
+
+    def __init__(self, path):
+        self.file = open(path, 'a')
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        record['time'] = time.time()
+        with self.lock:
+            self.file.write(json.dumps(record) + '\n')
+
+    def add_time(self, stage, seconds):
+        self.write({'stage': stage, 'ms': seconds * 1000})
+
+    def add_count(self, name, value):
+        self.write({'counter': name, 'value': value})
+
+    def add_outcome(self, stage, reason):
+        self.write({'stage': stage, 'outcome': reason})
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class MultiSink:
+    """ Passes everything to all sinks """
+
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def add_time(self, stage, seconds):
+        for sink in self.sinks:
+            sink.add_time(stage, seconds)
+
+    def add_count(self, name, value):
+        for sink in self.sinks:
+            sink.add_count(name, value)
+
+    def add_outcome(self, stage, reason):
+        for sink in self.sinks:
+            sink.add_outcome(stage, reason)
@@ -1,10 +1,26 @@
 import numpy as np
 import cv2
+import instrumentation
 
 
 class LineDetector:
     MAX_THETA_DIFFERENCE = np.pi / 14.0
     MAX_RHO_DIFFERENCE = 9
+    HOUGH_THRESHOLD = 180
+    HOUGH_THETA_STEP = np.pi / 180
+    # cluster mode compares lines above this angle with the lines near 0 as (-rho, theta - pi)
+    WRAP_THETA = np.pi / 4.0 * 3
+
+    MERGE_GREEDY = 'greedy'
+    MERGE_CLUSTER = 'cluster'
+
+    def __init__(self, merge_mode=MERGE_GREEDY, scale=1.0):
+        """ scale is size of the processed image relative to the size the thresholds were tuned for (400 px) """
+        if merge_mode not in (self.MERGE_GREEDY, self.MERGE_CLUSTER):
+            raise ValueError('Unknown line merge mode: {}'.format(merge_mode))
+        self.merge_mode = merge_mode
+        self.hough_threshold = max(1, int(round(self.HOUGH_THRESHOLD * scale)))
+        self.max_rho_difference = self.MAX_RHO_DIFFERENCE * max(1.0, scale)
 
     @staticmethod
     def combine_lines(line, merge_to_index, merged_lines, lines_count):
@@ -16,22 +32,22 @@ class LineDetector:
         lines_count[merge_to_index] += 1
 
     @staticmethod
-    def is_line_same(line1, line2):
+    def is_line_same(line1, line2, max_rho_difference=MAX_RHO_DIFFERENCE):
         rho1 = line1[0][0]
         theta1 = line1[0][1]
         rho2 = line2[0][0]
         theta2 = line2[0][1]
-        return abs(rho1 - rho2) < LineDetector.MAX_RHO_DIFFERENCE and\
+        return abs(rho1 - rho2) < max_rho_difference and\
             abs(theta1 - theta2) < LineDetector.MAX_THETA_DIFFERENCE
 
     @staticmethod
-    def merge_similar_lines(lines):
+    def merge_similar_lines(lines, max_rho_difference=MAX_RHO_DIFFERENCE):
         merged_lines = list()
         lines_count = list()
         for line in lines:
             need_to_be_added = True
             for i in range(len(merged_lines)):
-                if LineDetector.is_line_same(line, merged_lines[i]):
+                if LineDetector.is_line_same(line, merged_lines[i], max_rho_difference):
                     need_to_be_added = False
                     LineDetector.combine_lines(line, i, merged_lines, lines_count)
                     break
@@ -41,11 +57,63 @@ class LineDetector:
 
         return merged_lines
 
+    @staticmethod
+    def cluster_similar_lines(lines, max_rho_difference=MAX_RHO_DIFFERENCE):
+        """
+        Merges lines as merge_similar_lines does, every line joins the first merged line which is_line_same
+        with it, but merged lines are indexed by rho in bins of max_rho_difference, so a line is compared only
+        with the merged lines of the neighbouring bins instead of all of them. Lines above WRAP_THETA are
+        compared as (-rho, theta - pi), so a line found both near theta 0 and near pi is merged once.
+        Returns (K, 2) array of averaged (rho, theta) with theta in [0, pi) as given by HoughLines
+        """
+        lines = np.asarray(lines, dtype=np.float32).reshape((-1, 2))
+        wrapped = lines[:, 1] > LineDetector.WRAP_THETA
+        rho = np.where(wrapped, -lines[:, 0], lines[:, 0])
+        theta = np.where(wrapped, lines[:, 1] - np.float32(np.pi), lines[:, 1])
+
+        merged = list()
+        bins = dict()
+        for line_rho, line_theta in zip(rho.tolist(), theta.tolist()):
+            line_bin = int(line_rho // max_rho_difference)
+            best = None
+            for neighbour_bin in (line_bin - 1, line_bin, line_bin + 1):
+                for k in bins.get(neighbour_bin, ()):
+                    merged_rho, merged_theta, _ = merged[k]
+                    if (best is None or k < best) and abs(line_rho - merged_rho) < max_rho_difference \
+                            and abs(line_theta - merged_theta) < LineDetector.MAX_THETA_DIFFERENCE:
+                        best = k
+            if best is None:
+                bins.setdefault(line_bin, list()).append(len(merged))
+                merged.append([line_rho, line_theta, 1])
+                continue
+
+            merged_rho, merged_theta, count = merged[best]
+            old_bin = int(merged_rho // max_rho_difference)
+            merged_rho = (merged_rho * count + line_rho) / (count + 1)
+            merged[best] = [merged_rho, (merged_theta * count + line_theta) / (count + 1), count + 1]
+            new_bin = int(merged_rho // max_rho_difference)
+            if new_bin != old_bin:
+                bins[old_bin].remove(best)
+                bins.setdefault(new_bin, list()).append(best)
+        merged = np.float32([(merged_rho, merged_theta) for merged_rho, merged_theta, _ in merged]).reshape((-1, 2))
+        # theta less than half of the Hough step below 0 is 0, nearly pi would make the line normal degenerate
+        merged[(merged[:, 1] < 0) & (merged[:, 1] > -LineDetector.HOUGH_THETA_STEP / 2), 1] = 0
+        flipped = merged[:, 1] < 0
+        merged[flipped, 0] = -merged[flipped, 0]
+        merged[flipped, 1] += np.float32(np.pi)
+        return merged
+
+    @instrumentation.timed('find_lines')
     def find_lines(self, thresh_image):
-        lines = cv2.HoughLines(thresh_image, 1, np.pi / 180, 180, None, 0, 0)
+        lines = cv2.HoughLines(thresh_image, 1, self.HOUGH_THETA_STEP, self.hough_threshold, None, 0, 0)
         if lines is None:
             return None
-        lines = self.merge_similar_lines(lines)
+        instrumentation.count('hough_lines', len(lines))
+        if self.merge_mode == self.MERGE_CLUSTER:
+            lines = self.cluster_similar_lines(lines, self.max_rho_difference)
+        else:
+            lines = self.merge_similar_lines(lines, self.max_rho_difference)
+        instrumentation.count('merged_lines', len(lines))
         return lines
 
 
@@ -0,0 +1,191 @@
+import math
+import time
+import numpy as np
+from sudoku_solver import SudokuSolver
+
+
+class NumpySolver:
+    """
+    Data-parallel solver for a batch of grids held as an (N, size, size, size) boolean tensor,
+    candidates[k, r, c, d] is True when number d + 1 can still be placed to cell (r, c) of grid k.
+    Elimination and hidden singles are applied to the whole batch with NumPy reductions,
+    grids which get stuck are finished by batched backtracking on cells with the fewest candidates
+    """
+
+    def __init__(self, grid_size=9, max_batch=4096, max_nodes=None, max_time=None):
+        self.grid_size = grid_size
+        self.chunk_size = int(math.sqrt(grid_size))
+        self.max_batch = max_batch
+        self.max_nodes = max_nodes
+        self.max_time = max_time
+        self.nodes = 0
+
+    def grids_to_candidates(self, grids):
+        grids = np.asarray(grids, dtype=np.int32).reshape((-1, self.grid_size, self.grid_size))
+        numbers = np.arange(1, self.grid_size + 1, dtype=np.int32)
+        one_hot = grids[..., None] == numbers
+        return np.where((grids != SudokuSolver.EMPTY_CELL)[..., None], one_hot, True)
+
+    @staticmethod
+    def count(x, axis):
+        """ Counts True values along axis by adding slices, short inner axes reduce slowly in NumPy """
+        x = x.view(np.uint8)
+        index = [slice(None)] * x.ndim
+        index[axis] = 0
+        total = x[tuple(index)].copy()
+        for i in range(1, x.shape[axis]):
+            index[axis] = i
+            total += x[tuple(index)]
+        return total
+
+    def candidates_to_grids(self, candidates):
+        singles = self.count(candidates, 3) == 1
+        return np.where(singles, np.argmax(candidates, axis=3) + 1, SudokuSolver.EMPTY_CELL).astype(np.int32)
+
+    def to_chunks(self, x):
+        """ (N, size, size, size) -> (N, chunk_row, row, chunk_column, column, size) view """
+        c = self.chunk_size
+        return x.reshape((x.shape[0], c, c, c, c, self.grid_size))
+
+    def chunk_sums(self, x):
+        return self.count(self.count(self.to_chunks(x), 4), 2)
+
+    def expand_chunks(self, chunk_values):
+        """ (N, chunk_row, chunk_column, size) -> (N, size, size, size) """
+        c = self.chunk_size
+        expanded = np.repeat(np.repeat(chunk_values, c, axis=1), c, axis=2)
+        return expanded
+
+    def propagate_step(self, candidates):
+        singles = candidates & (self.count(candidates, 3) == 1)[..., None]
+        placed = (self.count(singles, 2) > 0)[:, :, None, :] \
+            | (self.count(singles, 1) > 0)[:, None, :, :] \
+            | self.expand_chunks(self.chunk_sums(singles) > 0)
+        candidates = candidates & ~(placed & ~singles)
+
+        hidden = candidates & (self.count(candidates, 2) == 1)[:, :, None, :]
+        hidden |= candidates & (self.count(candidates, 1) == 1)[:, None, :, :]
+        hidden |= candidates & self.expand_chunks(self.chunk_sums(candidates) == 1)
+        return np.where(hidden.any(axis=3)[..., None], hidden, candidates)
+
+    def propagate(self, candidates):
+        """
+        Applies elimination and hidden singles to the batch until nothing changes.
+        Only grids changed in the previous round are processed again
+        """
+        candidates = candidates.copy()
+        active = np.arange(len(candidates))
+        while len(active) > 0:
+            current = candidates[active]
+            updated = self.propagate_step(current)
+            changed = (updated != current).any(axis=(1, 2, 3))
+            candidates[active] = updated
+            active = active[changed]
+        return candidates
+
+    def find_contradictions(self, candidates):
+        counts = self.count(candidates, 3)
+        singles = candidates & (counts == 1)[..., None]
+        bad = (counts == 0).any(axis=(1, 2))
+        bad |= (self.count(candidates, 2) == 0).any(axis=(1, 2))
+        bad |= (self.count(candidates, 1) == 0).any(axis=(1, 2))
+        bad |= (self.chunk_sums(candidates) == 0).any(axis=(1, 2, 3))
+        bad |= (self.count(singles, 2) > 1).any(axis=(1, 2))
+        bad |= (self.count(singles, 1) > 1).any(axis=(1, 2))
+        bad |= (self.chunk_sums(singles) > 1).any(axis=(1, 2, 3))
+        return bad
+
+    def find_solved(self, candidates):
+        return (self.count(candidates, 3) == 1).all(axis=(1, 2))
+
+    def branch(self, candidates):
+        """
+        Picks the cell with the fewest candidates on every board and its lowest candidate.
+        Returns boards with the guess placed and boards with the guess removed
+        """
+        counts = self.count(candidates, 3)
+        counts = np.where(counts > 1, counts, self.grid_size + 1).reshape((len(candidates), -1))
+        cells = np.argmin(counts, axis=1)
+        rows, columns = np.divmod(cells, self.grid_size)
+        boards_ids = np.arange(len(candidates))
+        numbers = np.argmax(candidates[boards_ids, rows, columns], axis=1)
+
+        guess = candidates.copy()
+        guess[boards_ids, rows, columns, :] = False
+        guess[boards_ids, rows, columns, numbers] = True
+        rest = candidates.copy()
+        rest[boards_ids, rows, columns, numbers] = False
+        return guess, rest
+
+    def is_budget_exceeded(self, start):
+        return (self.max_nodes is not None and self.nodes >= self.max_nodes) \
+            or (self.max_time is not None and time.perf_counter() - start > self.max_time)
+
+    def solve(self, grids):
+        """
+        Solves batch of grids (N x size x size, 0 for empty cell).
+        Returns (N, size, size) array with solutions and list of SudokuSolver statuses
+        """
+        start = time.perf_counter()
+        self.nodes = 0
+        candidates = self.propagate(self.grids_to_candidates(grids))
+        solutions = self.candidates_to_grids(candidates)
+        bad = self.find_contradictions(candidates)
+        done = ~bad & self.find_solved(candidates)
+        statuses = np.where(bad, SudokuSolver.STATUS_UNSOLVABLE, SudokuSolver.STATUS_SOLVED).astype(object)
+
+        stalled = np.nonzero(~bad & ~done)[0]
+        stack = [(candidates[stalled], stalled)]
+        budget_exceeded = False
+        while stack:
+            boards, origins = stack.pop()
+            keep = ~done[origins]
+            boards, origins = boards[keep], origins[keep]
+            if len(boards) == 0:
+                continue
+            if self.is_budget_exceeded(start):
+                budget_exceeded = True
+                break
+            if len(boards) > self.max_batch:
+                stack.append((boards[self.max_batch:], origins[self.max_batch:]))
+                boards, origins = boards[:self.max_batch], origins[:self.max_batch]
+
+            self.nodes += len(boards)
+            boards = self.propagate(boards)
+            bad = self.find_contradictions(boards)
+            solved = ~bad & self.find_solved(boards)
+            solutions[origins[solved]] = self.candidates_to_grids(boards[solved])
+            done[origins[solved]] = True
+
+            alive = ~bad & ~solved
+            if alive.any():
+                guess, rest = self.branch(boards[alive])
+                # every stack entry holds at most one board per grid, guesses are explored first
+                stack.append((rest, origins[alive]))
+                stack.append((guess, origins[alive]))
+
+        unfinished = np.nonzero(~done & (statuses == SudokuSolver.STATUS_SOLVED))[0]
+        statuses[unfinished] = SudokuSolver.STATUS_BUDGET_EXCEEDED if budget_exceeded \
+            else SudokuSolver.STATUS_UNSOLVABLE
+        return solutions, list(statuses)
+
+
+if __name__ == "__main__":
+    table = [
+        [5, 3, 0, 0, 7, 0, 0, 0, 0],
+        [6, 0, 0, 1, 9, 5, 0, 0, 0],
+        [0, 9, 8, 0, 0, 0, 0, 6, 0],
+
+        [8, 0, 0, 0, 6, 0, 0, 0, 3],
+        [4, 0, 0, 8, 0, 3, 0, 0, 1],
+        [7, 0, 0, 0, 2, 0, 0, 0, 6],
+
+        [0, 6, 0, 0, 0, 0, 2, 8, 0],
+        [0, 0, 0, 4, 1, 9, 0, 0, 5],
+        [0, 0, 0, 0, 8, 0, 0, 7, 9],
+    ]
+
+    numpy_solver = NumpySolver(9)
+    solved_tables, solved_statuses = numpy_solver.solve([table] * 1000)
+    SudokuSolver.print_grid(solved_tables[0].tolist())
+    print(solved_statuses[0])
@@ -0,0 +1,209 @@
+import queue
+import threading
+import time
+import cv2
+from image_warper import ImageWarper
+
+
+class FramePacket:
+
+    def __init__(self, frame_id, image):
+        self.frame_id = frame_id
+        self.image = image
+        self.capture_time = time.perf_counter()
+        self.corners = None
+        self.warp = None
+        self.matrix = None
+        self.table = None
+        self.solved_table = None
+        self.result = None
+
+
+class StageStats:
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.dropped = 0
+
+    def add(self, elapsed):
+        self.count += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+
+    def get_mean_ms(self):
+        return self.total_time * 1000 / self.count if self.count > 0 else 0.0
+
+
+class PipelinedRunner:
+    """
+    Runs capture, grid detection, digit reading with solving and rendering in separate threads
+    connected by one-slot queues. With drop_frames a stage always gets the newest frame and older
+    ones waiting for it are dropped, so throughput is limited by the slowest stage only.
+    source is anything cv2.VideoCapture accepts (camera index or video file)
+    """
+
+    STAGES = ('capture', 'detect', 'read', 'render')
+    STOP = None
+
+    def __init__(self, ar_solver, source=0, crop=None, drop_frames=True):
+        self.ar_solver = ar_solver
+        self.source = source
+        self.crop = crop
+        self.drop_frames = drop_frames
+        self.detect_warper = ImageWarper()
+        self.render_warper = ImageWarper()
+        self.queues = [queue.Queue(maxsize=1) for _ in self.STAGES]
+        self.stats = {name: StageStats() for name in self.STAGES}
+        self.latency = StageStats()
+        self.stop_event = threading.Event()
+        self.threads = list()
+        self.start_time = None
+        self.end_time = None
+
+    def put(self, output_queue, packet, stats):
+        if not self.drop_frames or packet is self.STOP:
+            output_queue.put(packet)
+            return
+        try:
+            output_queue.put_nowait(packet)
+        except queue.Full:
+            try:
+                output_queue.get_nowait()
+                stats.dropped += 1
+            except queue.Empty:
+                pass
+            output_queue.put_nowait(packet)
+
+    def capture(self, output_queue, next_stats):
+        cap = cv2.VideoCapture(self.source)
+        stats = self.stats['capture']
+        frame_id = 0
+        try:
+            while not self.stop_event.is_set():
+                start = time.perf_counter()
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                if self.crop is not None:
+                    y, x, height, width = self.crop
+                    frame = frame[y:y + height, x:x + width]
+                stats.add(time.perf_counter() - start)
+                self.put(output_queue, FramePacket(frame_id, frame), next_stats)
+                frame_id += 1
+        finally:
+            cap.release()
+            self.put(output_queue, self.STOP, next_stats)
+
+    def detect(self, packet):
+        packet.image = self.ar_solver.prepare_image(packet.image)
+        packet.corners = self.ar_solver.find_grid_corners(packet.image, show_img=False)
+        if packet.corners is not None:
+            packet.warp = self.ar_solver.warp_grid(packet.image, packet.corners, self.detect_warper)
+            packet.matrix = self.detect_warper.get_matrix()
+
+    def read(self, packet):
+        if packet.warp is None:
+            return
+        packet.table = self.ar_solver.get_digit_reader().read_numbers(packet.warp)
+        packet.solved_table = self.ar_solver.solve_table(packet.table)
+
+    def render(self, packet):
+        if packet.solved_table is None:
+            packet.result = packet.image
+            return
+        self.render_warper.set_points(packet.corners, packet.matrix)
+        image_with_numbers = self.render_warper.render_numbers(packet.table, packet.solved_table)
+        packet.result = self.render_warper.draw_numbers_to_original(image_with_numbers, packet.image)
+
+    def run_stage(self, name, function, input_queue, output_queue, next_stats):
+        stats = self.stats[name]
+        try:
+            while True:
+                packet = input_queue.get()
+                if packet is self.STOP:
+                    break
+                start = time.perf_counter()
+                function(packet)
+                stats.add(time.perf_counter() - start)
+                self.put(output_queue, packet, next_stats)
+        except Exception:
+            # stop capturing and keep upstream stages from blocking on this stage's queue
+            self.stop_event.set()
+            while input_queue.get() is not self.STOP:
+                pass
+            raise
+        finally:
+            self.put(output_queue, self.STOP, next_stats)
+
+    def start(self):
+        self.ar_solver.preload_digit_reader()
+        self.start_time = time.perf_counter()
+        self.stop_event.clear()
+        capture_queue, detect_queue, read_queue, render_queue = self.queues
+        self.threads = [
+            threading.Thread(target=self.capture, args=(capture_queue, self.stats['detect']), daemon=True),
+            threading.Thread(target=self.run_stage, daemon=True,
+                             args=('detect', self.detect, capture_queue, detect_queue, self.stats['read'])),
+            threading.Thread(target=self.run_stage, daemon=True,
+                             args=('read', self.read, detect_queue, read_queue, self.stats['render'])),
+            threading.Thread(target=self.run_stage, daemon=True,
+                             args=('render', self.render, read_queue, render_queue, self.latency)),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def results(self):
+        """ Yields rendered packets until the source ends or stop() is called """
+        render_queue = self.queues[-1]
+        while True:
+            packet = render_queue.get()
+            if packet is self.STOP:
+                break
+            self.latency.add(time.perf_counter() - packet.capture_time)
+            if not self.stop_event.is_set():
+                yield packet
+        self.end_time = time.perf_counter()
+        for thread in self.threads:
+            thread.join()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self, display=True):
+        self.start()
+        for packet in self.results():
+            if display:
+                cv2.imshow('Video', packet.result)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    self.stop()
+        if display:
+            cv2.destroyAllWindows()
+        return self.get_report()
+
+    def get_report(self):
+        end_time = self.end_time or time.perf_counter()
+        elapsed = end_time - self.start_time if self.start_time is not None else 0.0
+        report = dict()
+        for name in self.STAGES:
+            stats = self.stats[name]
+            report[name] = {'frames': stats.count, 'mean_ms': stats.get_mean_ms(),
+                            'max_ms': stats.max_time * 1000, 'dropped': stats.dropped}
+        report['output'] = {'frames': self.latency.count, 'dropped': self.latency.dropped,
+                            'fps': self.latency.count / elapsed if elapsed > 0 else 0.0,
+                            'mean_latency_ms': self.latency.get_mean_ms(),
+                            'max_latency_ms': self.latency.max_time * 1000}
+        return report
+
+    @staticmethod
+    def print_report(report):
+        for name, values in report.items():
+            print(name, ', '.join('{}: {:.1f}'.format(key, value) for key, value in values.items()))
+
+
+if __name__ == "__main__":
+    from ar_solver import SudokuArSolver
+
+    runner = PipelinedRunner(SudokuArSolver(tracking=True, show_debug=False), 0, crop=(60, 180, 360, 360))
+    PipelinedRunner.print_report(runner.run())
@@ -1,4 +1,5 @@
 import numpy as np
+import instrumentation
 
 
 class PointsFinder:
@@ -7,8 +8,22 @@ class PointsFinder:
     INTERSECTION_T = 3
     INTERSECTION_CROSS = 4
 
-    def __init__(self, thresh, lines):
+    WHITE_THRESHOLD = 50
+    CROSSING_SPACE = 8
+    # 4-neighbourhood offsets at distance r as in check_point_surroundings
+    NEIGHBOURS = np.array([[1, 0], [0, 1], [-1, 0], [0, -1]])
+    CENTER_PROBES = np.concatenate([[[0, 0]], NEIGHBOURS, 3 * NEIGHBOURS])
+    CROSSING_PROBES = np.concatenate([[[0, 0]], NEIGHBOURS, 2 * NEIGHBOURS])
+
+    def __init__(self, thresh, lines, vectorized=True, crossing_space=CROSSING_SPACE):
+        """
+        lines are (rho, theta) pairs, as (K, 2) array or list of (1, 2) arrays from cv2.HoughLines.
+        crossing_space is the distance from an intersection at which crossing lines are probed,
+        it grows with the image scale
+        """
+        lines = np.asarray(lines, dtype=np.float32).reshape((-1, 2))
         self.lines = lines
+        self.crossing_space = crossing_space
         self.thresh = thresh
         self.points = list()
         self.lines_with_points = list()
@@ -16,8 +31,13 @@ class PointsFinder:
             self.lines_with_points.append(list())
         self.width, self.height = thresh.shape
 
-        self.find_all_intersections( lines, thresh)
-        self.sort_points_in_all_lines()
+        with instrumentation.timer('find_points'):
+            if vectorized:
+                self.find_all_intersections_vectorized(lines, thresh)
+            else:
+                self.find_all_intersections(lines, thresh)
+            self.sort_points_in_all_lines()
+        instrumentation.count('intersection_points', len(self.points))
 
     def get_points(self):
         return self.points
@@ -27,7 +47,7 @@ class PointsFinder:
 
     @staticmethod
     def is_line_horizontal(line):
-        theta = line[0][1]
+        theta = line[1]
         return np.pi / 4 < theta < np.pi / 4.0 * 3
 
     def sort_points_in_all_lines(self):
@@ -47,12 +67,12 @@ class PointsFinder:
 
     def find_all_intersections(self, lines, img):
         for i in range(len(lines)):
-            rho, theta = lines[i][0]
+            rho, theta = lines[i]
             a, b, c, x0, y0 = self.get_line_paramaters(theta, rho)
             for j in range(i + 1, len(lines), 1):
                 if i == j:
                     continue
-                rho2, theta2 = lines[j][0]
+                rho2, theta2 = lines[j]
                 d, e, f, x1, y1 = self.get_line_paramaters(theta2, rho2)
                 p = self.find_intersection(a, b, c, d, e, f)
                 if p is None:
@@ -62,11 +82,110 @@ class PointsFinder:
                     continue
                 if p[1] < 0 or p[1] >= self.width:
                     continue
-                t = self.get_type_of_intersection(p, (a, b, c), (d, e, f), img)
+                t = self.get_type_of_intersection(p, (a, b, c), (d, e, f), img, self.crossing_space)
                 if t is None:
                     continue
                 self.add_point(p, t, i, j)
 
+    def find_all_intersections_vectorized(self, lines, img):
+        """
+        Intersects all line pairs at once and classifies the intersections by sampling
+        all probe pixels with one gather. Gives the same points as find_all_intersections
+        """
+        if len(lines) < 2:
+            return
+        a, b, c, _, _ = self.get_line_paramaters(lines[:, 1], lines[:, 0])
+
+        # same pair order as the loops in find_all_intersections
+        first, second = np.triu_indices(len(lines), 1)
+        x, y = self.find_intersections(a[first], b[first], c[first], a[second], b[second], c[second])
+        valid = np.isfinite(x) & np.isfinite(y)
+        x = np.trunc(np.where(valid, x, -1))
+        y = np.trunc(np.where(valid, y, -1))
+        valid &= (x >= 0) & (x < self.height) & (y >= 0) & (y < self.width)
+        first, second = first[valid], second[valid]
+        points = np.stack([x[valid], y[valid]], axis=1).astype(np.int64)
+
+        instrumentation.count('intersections_tested', len(points))
+        types = self.get_types_of_intersections(points, a, b, first, second, img, self.crossing_space)
+        for (px, py), t, i, j in zip(points.tolist(), types.tolist(), first.tolist(), second.tolist()):
+            if t != 0:
+                self.add_point((px, py), t, i, j)
+
+    @staticmethod
+    def find_intersections(a, b, c, d, e, f):
+        """
+        Vectorized find_intersection, every case of it is evaluated for all pairs and the first
+        matching case is picked. Returns x and y arrays, nan where there is no intersection
+        """
+        nan = np.float32(np.nan)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            x = np.full_like(a, nan)
+            y = np.full_like(a, nan)
+            undecided = np.ones(a.shape, dtype=bool)
+
+            def pick(case, case_x, case_y):
+                case = case & undecided
+                x[case] = case_x[case]
+                y[case] = case_y[case]
+                undecided[case] = False
+
+            y1 = -f / e
+            pick((d == 0) & (a != 0), (-b * y1 - c) / a, y1)
+            y2 = -c / b
+            pick((d != 0) & (a == 0), (-e * y2 - f) / d, y2)
+            undecided[(d == 0) & (a == 0)] = False
+            x4 = - c / a
+            pick((b == 0) & (e != 0), x4, (-d * x4 - f) / e)
+            x5 = - f / d
+            pick((e == 0) & (b != 0), x5, (-a * x5 - c) / b)
+            undecided[(e == 0) & (b == 0)] = False
+
+            cc7 = (a - (b * d) / e)
+            x7 = (b * f / e - c) / cc7
+            case7 = (np.abs(d) < 0.1) | (np.abs(a) < 0.1)
+            undecided[case7 & (cc7 == 0)] = False
+            pick(case7, x7, (-d * x7 - f) / e)
+            cc8 = (b - a * e / d)
+            y8 = (a * f / d - c) / cc8
+            undecided[cc8 == 0] = False
+            pick(undecided, (-b * y8 - c) / a, y8)
+        return x, y
+
+    @staticmethod
+    def are_points_white(img, probes):
+        """ probes is (..., 2) array of x, y positions, returns which of them are white and inside img """
+        xs = probes[..., 0]
+        ys = probes[..., 1]
+        inside = (xs >= 0) & (xs < img.shape[1]) & (ys >= 0) & (ys < img.shape[0])
+        values = img[np.clip(ys, 0, img.shape[0] - 1), np.clip(xs, 0, img.shape[1] - 1)]
+        return inside & (values >= PointsFinder.WHITE_THRESHOLD)
+
+    @staticmethod
+    def get_types_of_intersections(points, a, b, first, second, img, space=CROSSING_SPACE):
+        """ Vectorized get_type_of_intersection, 0 stands for no intersection """
+        # crossing probes are moved along the normal of each line to both sides, as in get_number_of_line_crossing
+        float_points = points.astype(a.dtype)
+        bases = list()
+        for line_ids in (first, second):
+            na, nb = PointsFinder.norm_vector(a[line_ids], b[line_ids])
+            for mul in (1, -1):
+                bases.append(np.stack([np.trunc(float_points[:, 0] + mul * na * space),
+                                       np.trunc(float_points[:, 1] + mul * nb * space)],
+                                      axis=1).astype(np.int64))
+
+        center = PointsFinder.are_points_white(img, points[:, None, :] + PointsFinder.CENTER_PROBES).any(axis=1)
+        crossings = [PointsFinder.are_points_white(img, base[:, None, :] + PointsFinder.CROSSING_PROBES).any(axis=1)
+                     for base in bases]
+        n = crossings[0].astype(np.int64) + crossings[1]
+        m = crossings[2].astype(np.int64) + crossings[3]
+
+        types = np.full(len(points), PointsFinder.INTERSECTION_T)
+        types[(n == 1) & (m == 1)] = PointsFinder.INTERSECTION_CORNER
+        types[(n == 2) & (m == 2)] = PointsFinder.INTERSECTION_CROSS
+        types[((n == 2) & (m == 0)) | ((n == 0) & (m == 2)) | ~center] = 0
+        return types
+
     @staticmethod
     def get_line_paramaters(theta, rho):
         a = np.cos(theta)
@@ -103,8 +222,7 @@ class PointsFinder:
         return PointsFinder.check_point_surroundings(img, mx, my, 2)
 
     @staticmethod
-    def get_number_of_line_crossing(img, x, y, a, b):
-        space = 8
+    def get_number_of_line_crossing(img, x, y, a, b, space=CROSSING_SPACE):
         line_inter = 0
         na, nb = PointsFinder.norm_vector(a, b)
         if PointsFinder.checkpoint(img, space, x, y, na, nb, 1):
@@ -134,14 +252,14 @@ class PointsFinder:
         return False
 
     @staticmethod
-    def get_type_of_intersection(pos, line1, line2, img):
+    def get_type_of_intersection(pos, line1, line2, img, space=CROSSING_SPACE):
         x, y = pos
         a, b, c = line1
         d, e, f = line2
         if not PointsFinder.is_point_or_surrounding_white(img, x, y):
             return None
-        n = PointsFinder.get_number_of_line_crossing(img, x, y, a, b)
-        m = PointsFinder.get_number_of_line_crossing(img, x, y, d, e)
+        n = PointsFinder.get_number_of_line_crossing(img, x, y, a, b, space)
+        m = PointsFinder.get_number_of_line_crossing(img, x, y, d, e, space)
         if (n == 2 and m == 0) or (n == 0 and m == 2):
             return None
         if n == 2 and m == 2:
@@ -0,0 +1,116 @@
+import math
+from collections import OrderedDict
+from itertools import permutations
+
+
+class SolutionCache:
+    """
+    LRU cache of solved grids keyed by the givens.
+    With canonicalize=True equivalent puzzles (numbers relabeled, transposed, bands or stacks swapped)
+    share one entry, the key is the smallest relabeled form over all those transformations
+    """
+
+    EMPTY_CELL = 0
+
+    def __init__(self, grid_size=9, max_size=64, canonicalize=False):
+        self.grid_size = grid_size
+        self.chunk_size = int(math.sqrt(grid_size))
+        self.max_size = max_size
+        self.canonicalize = canonicalize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.permutations = self.create_permutations() if canonicalize else None
+        self.last_key = None
+
+    def create_permutations(self):
+        """ Every permutation p maps cell i of the transformed grid to cell p[i] of the original one """
+        size = self.grid_size
+        chunk = self.chunk_size
+        cells_permutations = list()
+        for transpose in (False, True):
+            for bands in permutations(range(chunk)):
+                for stacks in permutations(range(chunk)):
+                    rows = [band * chunk + r for band in bands for r in range(chunk)]
+                    columns = [stack * chunk + c for stack in stacks for c in range(chunk)]
+                    if transpose:
+                        cells = [columns[c] * size + rows[r] for r in range(size) for c in range(size)]
+                    else:
+                        cells = [rows[r] * size + columns[c] for r in range(size) for c in range(size)]
+                    cells_permutations.append(cells)
+        return cells_permutations
+
+    def get_key(self, grid):
+        """ Returns cache key and transformation (cells permutation, numbers relabeling) to the key """
+        cells = tuple(int(cell) for row in grid for cell in row)
+        if not self.canonicalize:
+            return cells, None
+        if self.last_key is not None and self.last_key[0] == cells:
+            # put() usually follows get() of the same givens
+            return self.last_key[1]
+
+        best = None
+        for permutation in self.permutations:
+            relabel = dict()
+            key = list()
+            for index in permutation:
+                number = cells[index]
+                if number != self.EMPTY_CELL and number not in relabel:
+                    relabel[number] = len(relabel) + 1
+                key.append(relabel.get(number, self.EMPTY_CELL))
+            key = tuple(key)
+            if best is None or key < best[0]:
+                best = key, permutation, relabel
+
+        key, permutation, relabel = best
+        # numbers missing in the givens are labeled in increasing order
+        for number in range(1, self.grid_size + 1):
+            if number not in relabel:
+                relabel[number] = len(relabel) + 1
+        self.last_key = cells, (key, (permutation, relabel))
+        return key, (permutation, relabel)
+
+    def to_key_space(self, grid, transformation):
+        cells = [int(cell) for row in grid for cell in row]
+        if transformation is None:
+            return tuple(cells)
+        permutation, relabel = transformation
+        return tuple(relabel.get(cells[index], self.EMPTY_CELL) for index in permutation)
+
+    def from_key_space(self, cells, transformation):
+        if transformation is not None:
+            permutation, relabel = transformation
+            labels = {label: number for number, label in relabel.items()}
+            original = [self.EMPTY_CELL] * len(cells)
+            for i, index in enumerate(permutation):
+                original[index] = labels.get(cells[i], self.EMPTY_CELL)
+            cells = original
+        return [list(cells[i * self.grid_size:(i + 1) * self.grid_size]) for i in range(self.grid_size)]
+
+    def get(self, grid):
+        """ Returns (solved grid, solver status) for the givens or None """
+        key, transformation = self.get_key(grid)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        solution, status = entry
+        return self.from_key_space(solution, transformation), status
+
+    def put(self, grid, solution, status):
+        key, transformation = self.get_key(grid)
+        self.entries[key] = self.to_key_space(solution, transformation), status
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
@@ -0,0 +1,283 @@
+import argparse
+import base64
+import copy
+import json
+import multiprocessing
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import cv2
+import numpy as np
+from ar_solver import SudokuArSolver, SolveResult
+from batch_solver import parse_puzzle_line
+from digit_reader import DigitReader
+from image_warper import ImageWarper
+from sudoku_solver import SudokuSolver
+
+Detection = namedtuple('Detection', ['corners', 'warp', 'matrix', 'image', 'timings'])
+
+_worker_ar_solver = None
+
+
+def init_worker(solver_kwargs):
+    global _worker_ar_solver
+    _worker_ar_solver = SudokuArSolver(show_debug=False, **solver_kwargs)
+
+
+def detect_grid(data, with_image):
+    """ Decodes the image and finds and warps its grid, runs in a worker process without the digit model """
+    timings = dict()
+    start = time.perf_counter()
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    image = _worker_ar_solver.prepare_image(image)
+    timings['decode'] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    corners = _worker_ar_solver.find_grid_corners(image, show_img=False)
+    timings['detect'] = (time.perf_counter() - start) * 1000
+    if corners is None:
+        return Detection(None, None, None, image if with_image else None, timings)
+
+    start = time.perf_counter()
+    warper = ImageWarper()
+    warp = _worker_ar_solver.warp_grid(image, corners, warper)
+    timings['warp'] = (time.perf_counter() - start) * 1000
+    return Detection(corners, warp, warper.get_matrix(), image if with_image else None, timings)
+
+
+class DigitBatcher:
+    """
+    Reads digits of warps coming from many request threads. The first waiting warp is batched with
+    those which come within max_wait seconds, up to max_batch of them, into one inference call.
+    It waits only while some requests announced by expect() are still being detected
+    """
+
+    STOP = None
+
+    def __init__(self, digit_reader, max_batch=16, max_wait=0.005):
+        self.digit_reader = digit_reader
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.items = 0
+        self.expected = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def expect(self):
+        with self.lock:
+            self.expected += 1
+
+    def cancel(self):
+        """ The expected request has no warp to read """
+        with self.lock:
+            self.expected -= 1
+
+    def read(self, warp):
+        """ Returns (table, confidences) of the warp of an expected request, blocks until its batch is read """
+        future = Future()
+        with self.lock:
+            self.expected -= 1
+            self.queue.put((warp, future))
+        return future.result()
+
+    def collect(self, first):
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or (self.expected == 0 and self.queue.empty()):
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is self.STOP:
+                self.queue.put(item)
+                break
+            batch.append(item)
+        return batch
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is self.STOP:
+                break
+            batch = self.collect(item)
+            try:
+                tables, confidences = self.digit_reader.read_numbers_batch_with_confidence([w for w, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), table, table_confidences in zip(batch, tables, confidences):
+                future.set_result((table, table_confidences))
+
+    def get_mean_batch_size(self):
+        return self.items / self.batches if self.batches > 0 else 0.0
+
+    def close(self):
+        self.queue.put(self.STOP)
+        self.thread.join()
+
+
+class SolveService:
+    """
+    Solves images and grids for the HTTP handler. The digit model is loaded once in this process,
+    grids are found in a pool of worker processes and their digits are read in micro-batches
+    """
+
+    def __init__(self, workers=None, backend='tensorflow', max_batch=16, max_wait=0.005, **solver_kwargs):
+        # workers are forked before any thread or model exists in this process
+        workers = workers or multiprocessing.cpu_count()
+        self.pool = multiprocessing.Pool(workers, initializer=init_worker, initargs=(solver_kwargs,))
+        self.batcher = DigitBatcher(DigitReader(backend), max_batch, max_wait)
+        self.local = threading.local()
+        self.request_count = 0
+        self.lock = threading.Lock()
+
+    def get_sudoku_solver(self):
+        if not hasattr(self.local, 'sudoku_solver'):
+            self.local.sudoku_solver = SudokuSolver(9, max_time=SudokuArSolver.MAX_SOLVE_TIME,
+                                                     check_unique=True)
+        return self.local.sudoku_solver
+
+    def next_request_id(self):
+        with self.lock:
+            self.request_count += 1
+            return self.request_count
+
+    def solve_image(self, data, overlay=False):
+        """ Returns SolveResult dict of the encoded image, with overlay a base64 PNG of the drawn solution """
+        result = SolveResult(self.next_request_id())
+        self.batcher.expect()
+        try:
+            detection = self.pool.apply(detect_grid, (data, overlay))
+        except Exception:
+            self.batcher.cancel()
+            raise
+        if detection is None or detection.corners is None:
+            self.batcher.cancel()
+        if detection is None:
+            raise ValueError('Image can not be decoded')
+        result.timings.update(detection.timings)
+        result.corners = detection.corners
+        image = detection.image
+        if detection.corners is not None:
+            start = time.perf_counter()
+            result.table, result.confidences = self.batcher.read(detection.warp)
+            result.timings['read'] = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            sudoku_solver = self.get_sudoku_solver()
+            result.solved_table = sudoku_solver.solve(copy.deepcopy(result.table))
+            result.status = sudoku_solver.status
+            result.timings['solve'] = (time.perf_counter() - start) * 1000
+
+            if overlay:
+                warper = ImageWarper()
+                warper.set_points(detection.corners, detection.matrix)
+                numbers = warper.render_numbers(result.table, result.solved_table)
+                image = warper.draw_numbers_to_original(numbers, image)
+
+        response = result.to_dict()
+        if overlay:
+            response['overlay'] = base64.b64encode(cv2.imencode('.png', image)[1].tobytes()).decode('ascii')
+        return response
+
+    def solve_grid(self, grid):
+        """ grid is a 9x9 list or an 81 character string with '0' or '.' for empty cells """
+        if isinstance(grid, str):
+            grid = parse_puzzle_line(grid)
+        if grid is None or len(grid) != 9 or any(len(row) != 9 for row in grid):
+            raise ValueError('Grid has to be 9x9')
+        start = time.perf_counter()
+        sudoku_solver = self.get_sudoku_solver()
+        solved_table = sudoku_solver.solve([[int(number) for number in row] for row in grid])
+        return {'solved_table': [[int(number) for number in row] for row in solved_table],
+                'status': sudoku_solver.status, 'time_ms': (time.perf_counter() - start) * 1000}
+
+    def get_stats(self):
+        return {'requests': self.request_count, 'batches': self.batcher.batches,
+                'mean_batch_size': self.batcher.get_mean_batch_size()}
+
+    def close(self):
+        self.batcher.close()
+        self.pool.terminate()
+        self.pool.join()
+
+
+class SolveRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /solve with an encoded image as the body (?overlay=1 adds the drawn solution),
+    POST /grid with JSON {"grid": ...}, GET /stats
+    """
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/stats':
+            self.send_json(200, self.server.service.get_stats())
+        else:
+            self.send_json(404, {'error': 'Unknown path'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            if url.path == '/solve':
+                overlay = parse_qs(url.query).get('overlay', ['0'])[0] not in ('0', 'false')
+                self.send_json(200, self.server.service.solve_image(body, overlay))
+            elif url.path == '/grid':
+                self.send_json(200, self.server.service.solve_grid(json.loads(body)['grid']))
+            else:
+                self.send_json(404, {'error': 'Unknown path'})
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {'error': str(e)})
+
+    def send_json(self, code, content):
+        data = json.dumps(content).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_server(service, port=8080, host='127.0.0.1'):
+    server = ThreadingHTTPServer((host, port), SolveRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local HTTP service solving sudoku images and grids')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=None, help='processes finding grids')
+    parser.add_argument('--backend', default='tensorflow')
+    parser.add_argument('--max-batch', type=int, default=16)
+    parser.add_argument('--max-wait', type=float, default=0.005, help='seconds a batch waits for more images')
+    args = parser.parse_args()
+
+    solve_service = SolveService(args.workers, args.backend, args.max_batch, args.max_wait)
+    http_server = create_server(solve_service, args.port)
+    print('Listening on http://127.0.0.1:{}'.format(args.port))
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_server.server_close()
+        solve_service.close()
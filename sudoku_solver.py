@@ -1,12 +1,39 @@
 import math
+from bitmask_solver import BitmaskSolver
+import instrumentation
 
 
 class SudokuSolver:
     EMPTY_CELL = 0
 
-    def __init__(self, grid_size):
+    ENGINE_LISTS = 'lists'
+    ENGINE_BITMASK = 'bitmask'
+
+    STATUS_SOLVED = BitmaskSolver.STATUS_SOLVED
+    STATUS_UNSOLVABLE = BitmaskSolver.STATUS_UNSOLVABLE
+    STATUS_BUDGET_EXCEEDED = BitmaskSolver.STATUS_BUDGET_EXCEEDED
+    STATUS_UNFINISHED = 'unfinished'
+    STATUS_MULTIPLE_SOLUTIONS = 'multiple_solutions'
+
+    def __init__(self, grid_size, engine=ENGINE_BITMASK, search=True, max_nodes=100000, max_time=None,
+                 check_unique=False):
+        """
+        engine selects the constraint propagation, search enables backtracking after
+        propagation gets stuck, limited to max_nodes guesses and max_time seconds (None means no limit).
+        With check_unique the search also looks for a second solution, a grid which has more of them
+        gets STATUS_MULTIPLE_SOLUTIONS and only the numbers following from propagation are filled
+        """
+        if engine not in (self.ENGINE_LISTS, self.ENGINE_BITMASK):
+            raise ValueError('Unknown solver engine: {}'.format(engine))
         self.grid_size = grid_size
         self.chunk_size = int(math.sqrt(self.grid_size))
+        self.engine = engine
+        self.search = search
+        self.max_nodes = max_nodes
+        self.max_time = max_time
+        self.check_unique = check_unique
+        self.bitmask_solver = BitmaskSolver(grid_size)
+        self.status = None
         self.possibilities_rows = list()
         self.possibilities_columns = list()
         self.possibilities_chunks = list()
@@ -55,17 +82,79 @@ class SudokuSolver:
             else:
                 self.possibilities_chunks.append(not_used_numbers)
 
+    @instrumentation.timed('solve')
     def solve(self, grid):
+        if self.engine == self.ENGINE_BITMASK:
+            return self.solve_bitmask(grid)
+
         self.read_grid(grid)
         if not self.is_solvable():
-            print('Grid is invalid')
+            instrumentation.outcome('solve', 'invalid_grid')
+            self.status = self.STATUS_UNSOLVABLE
             return grid
 
+        passes = 1
         while self.solve_step():
-            pass
+            passes += 1
+        instrumentation.count('solver_passes', passes)
 
+        if self.search:
+            return self.solve_bitmask(grid)
+        self.status = self.STATUS_SOLVED if self.is_grid_full(grid) else self.STATUS_UNFINISHED
+        instrumentation.outcome('solve', self.status)
         return grid
 
+    def solve_bitmask(self, grid):
+        if not self.bitmask_solver.read_grid(grid):
+            instrumentation.outcome('solve', 'invalid_grid')
+            self.status = self.STATUS_UNSOLVABLE
+            return grid
+
+        if self.search and self.check_unique:
+            self.status = self.get_count_status(self.bitmask_solver.count_solutions(2, self.max_nodes,
+                                                                                    self.max_time))
+            instrumentation.count('solver_nodes', self.bitmask_solver.nodes)
+        elif self.search:
+            self.status = self.bitmask_solver.search(self.max_nodes, self.max_time)
+            instrumentation.count('solver_nodes', self.bitmask_solver.nodes)
+        elif not self.bitmask_solver.propagate():
+            self.status = self.STATUS_UNSOLVABLE
+        elif self.bitmask_solver.is_solved():
+            self.status = self.STATUS_SOLVED
+        else:
+            self.status = self.STATUS_UNFINISHED
+        if self.engine == self.ENGINE_BITMASK:
+            # the lists engine has counted its own passes before handing the grid over
+            instrumentation.count('solver_passes', self.bitmask_solver.passes)
+        instrumentation.outcome('solve', self.status)
+        return self.bitmask_solver.write_grid(grid)
+
+    def count_solutions(self, grid, limit=2):
+        """
+        Number of solutions of grid, the search stops once limit of them is found. Returns None
+        when max_nodes or max_time runs out first, grid is not changed
+        """
+        if not self.bitmask_solver.read_grid(grid):
+            return 0
+        return self.bitmask_solver.count_solutions(limit, self.max_nodes, self.max_time)
+
+    def has_unique_solution(self, grid):
+        """ False also when the search budget runs out before the answer is known """
+        return self.count_solutions(grid, 2) == 1
+
+    def get_count_status(self, count):
+        if count is None:
+            return self.STATUS_BUDGET_EXCEEDED
+        if count == 0:
+            return self.STATUS_UNSOLVABLE
+        return self.STATUS_SOLVED if count == 1 else self.STATUS_MULTIPLE_SOLUTIONS
+
+    def is_grid_full(self, grid):
+        for row in grid:
+            if self.EMPTY_CELL in row:
+                return False
+        return True
+
     def solve_step(self):
         new_number_added = False
         for row_index in range(self.grid_size):
@@ -206,3 +295,4 @@ if __name__ == "__main__":
     sudokuSolver = SudokuSolver(9)
     solve_table = sudokuSolver.solve(table)
     sudokuSolver.print_grid(solve_table)
+    print(sudokuSolver.status)